@@ -0,0 +1,323 @@
+import math
+import threading
+import time
+import uuid
+from collections import Counter
+from functools import wraps
+
+from flask import request, session
+
+try:
+    import redis
+except ImportError:  # only needed for the shared (redis) limiter store
+    redis = None
+
+
+class UpstreamLimit:
+    """
+    Admission limits for one upstream service.
+
+    Args:
+        rate: Requests per second each user may start (token refill rate).
+        burst: Token bucket size, i.e. how many requests a user may start at once.
+        max_concurrency: Requests allowed to run against the upstream at the same time.
+        max_waiting: Requests allowed to queue for a free slot; more are rejected immediately.
+        wait_timeout: Seconds a queued request waits for a slot before it is rejected.
+    """
+
+    def __init__(self, rate, burst, max_concurrency, max_waiting, wait_timeout):
+        self.rate = rate
+        self.burst = burst
+        self.max_concurrency = max_concurrency
+        self.max_waiting = max_waiting
+        self.wait_timeout = wait_timeout
+
+
+class AdmissionRejected(Exception):
+    def __init__(self, upstream, reason, retry_after):
+        super().__init__(f"{upstream}: {reason}")
+        self.upstream = upstream
+        self.reason = reason  # 'rate_limited', 'queue_full' or 'timeout'
+        self.retry_after = max(1, math.ceil(retry_after))
+
+
+class MemoryLimiterStore:
+    """
+    Limiter state kept in this process. Limits apply per worker process.
+
+    Buckets that have been full for longer than burst / rate are dropped every
+    prune_interval seconds; a missing bucket is a full one.
+    """
+
+    def __init__(self, prune_interval=60):
+        self.prune_interval = prune_interval
+        self._lock = threading.Lock()
+        self._buckets = {}  # key -> (tokens, timestamp, time after which the bucket can be dropped)
+        self._next_prune = time.monotonic() + prune_interval
+        self._slots = {}  # name -> _Slots
+
+    def take_token(self, key, rate, burst):
+        """Takes one token from the bucket. Returns (allowed, seconds until a token is available)."""
+        now = time.monotonic()
+        with self._lock:
+            if now >= self._next_prune:
+                self._prune(now)
+            tokens, updated, _ = self._buckets.get(key, (burst, now, None))
+            tokens = min(burst, tokens + (now - updated) * rate)
+            if tokens >= 1:
+                self._set_bucket(key, tokens - 1, now, rate, burst)
+                return True, 0.0
+            self._set_bucket(key, tokens, now, rate, burst)
+            return False, (1 - tokens) / rate
+
+    def refund_token(self, key, rate, burst):
+        """Gives back a token taken for a request that was not admitted."""
+        with self._lock:
+            if key in self._buckets:
+                tokens, updated, _ = self._buckets[key]
+                self._set_bucket(key, min(burst, tokens + 1), updated, rate, burst)
+
+    def bucket_count(self):
+        with self._lock:
+            return len(self._buckets)
+
+    def _set_bucket(self, key, tokens, updated, rate, burst):
+        # Full again after (burst - tokens) / rate, then kept for another burst / rate
+        self._buckets[key] = (tokens, updated, updated + (2 * burst - tokens) / rate)
+
+    def _prune(self, now):
+        for key in [key for key, (_, _, expires) in self._buckets.items() if expires < now]:
+            del self._buckets[key]
+        self._next_prune = now + self.prune_interval
+
+    def acquire_slot(self, name, limit, max_waiting, timeout):
+        """
+        Waits up to timeout seconds for one of limit slots.
+
+        Returns a token to pass to release_slot(), or raises AdmissionRejected
+        ('queue_full' or 'timeout').
+        """
+        with self._lock:
+            slots = self._slots.setdefault(name, _Slots(self._lock))
+        return slots.acquire(name, limit, max_waiting, timeout)
+
+    def release_slot(self, name, token):
+        with self._lock:
+            self._slots[name].release()
+
+    def slot_usage(self, name):
+        """Returns (in_flight, waiting) for the slots."""
+        with self._lock:
+            slots = self._slots.get(name)
+            return (slots.in_flight, slots.waiting) if slots else (0, 0)
+
+
+class _Slots:
+    def __init__(self, lock):
+        self.condition = threading.Condition(lock)
+        self.in_flight = 0
+        self.waiting = 0
+
+    def acquire(self, name, limit, max_waiting, timeout):
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            if self.in_flight < limit:
+                self.in_flight += 1
+                return None
+            if self.waiting >= max_waiting:
+                raise AdmissionRejected(name, 'queue_full', timeout)
+            self.waiting += 1
+            try:
+                while self.in_flight >= limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise AdmissionRejected(name, 'timeout', timeout)
+                    self.condition.wait(remaining)
+                self.in_flight += 1
+                return None
+            finally:
+                self.waiting -= 1
+
+    def release(self):
+        self.in_flight -= 1
+        self.condition.notify()
+
+
+# KEYS[1]: bucket; ARGV: rate, burst. Uses the Redis clock so all workers agree.
+_TAKE_TOKEN_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local burst = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(state[1]) or burst
+local updated = tonumber(state[2]) or now
+tokens = math.min(burst, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'ts', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(burst / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+# KEYS[1]: bucket; ARGV: burst. A missing bucket is already full.
+_REFUND_TOKEN_SCRIPT = """
+local tokens = tonumber(redis.call('HGET', KEYS[1], 'tokens'))
+if tokens then
+    redis.call('HSET', KEYS[1], 'tokens', tostring(math.min(tonumber(ARGV[1]), tokens + 1)))
+end
+return 0
+"""
+
+# KEYS[1]: holders or waiters (sorted set scored by lease expiry); ARGV: limit, token, lease seconds.
+# Expired leases are dropped first, so a crashed worker cannot leak slots or queue places.
+_ACQUIRE_SLOT_SCRIPT = """
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+if redis.call('ZCARD', KEYS[1]) < tonumber(ARGV[1]) then
+    redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+    return 1
+end
+return 0
+"""
+
+
+class RedisLimiterStore:
+    """
+    Limiter state shared by all workers through Redis.
+
+    Slots are leases that expire after lease_seconds, which must exceed the
+    slowest upstream call. Waiting requests hold a place in the queue with a
+    lease that expires shortly after their wait timeout, and poll for a free slot.
+    """
+
+    def __init__(self, url, prefix='admission', lease_seconds=300, poll_interval=0.05):
+        if redis is None:
+            raise RuntimeError("The redis package is required for ADMISSION_STORE=redis")
+        self.client = redis.Redis.from_url(url)
+        self.prefix = prefix
+        self.lease_seconds = lease_seconds
+        self.poll_interval = poll_interval
+        self._take_token = self.client.register_script(_TAKE_TOKEN_SCRIPT)
+        self._refund_token = self.client.register_script(_REFUND_TOKEN_SCRIPT)
+        self._acquire = self.client.register_script(_ACQUIRE_SLOT_SCRIPT)
+
+    def take_token(self, key, rate, burst):
+        allowed, retry_after = self._take_token(keys=[f"{self.prefix}:bucket:{key}"], args=[rate, burst])
+        return bool(allowed), float(retry_after)
+
+    def refund_token(self, key, rate, burst):
+        self._refund_token(keys=[f"{self.prefix}:bucket:{key}"], args=[burst])
+
+    def acquire_slot(self, name, limit, max_waiting, timeout):
+        holders, waiting = self._keys(name)
+        token = str(uuid.uuid4())
+        if self._acquire(keys=[holders], args=[limit, token, self.lease_seconds]):
+            return token
+        if not self._acquire(keys=[waiting], args=[max_waiting, token, timeout + self.poll_interval + 1]):
+            raise AdmissionRejected(name, 'queue_full', timeout)
+        try:
+            deadline = time.monotonic() + timeout
+            while time.monotonic() < deadline:
+                time.sleep(self.poll_interval)
+                if self._acquire(keys=[holders], args=[limit, token, self.lease_seconds]):
+                    return token
+            raise AdmissionRejected(name, 'timeout', timeout)
+        finally:
+            self.client.zrem(waiting, token)
+
+    def release_slot(self, name, token):
+        self.client.zrem(self._keys(name)[0], token)
+
+    def slot_usage(self, name):
+        holders, waiting = self._keys(name)
+        now = time.time()
+        self.client.zremrangebyscore(holders, '-inf', now)
+        self.client.zremrangebyscore(waiting, '-inf', now)
+        return self.client.zcard(holders), self.client.zcard(waiting)
+
+    def _keys(self, name):
+        return f"{self.prefix}:slots:{name}", f"{self.prefix}:waiting:{name}"
+
+
+def create_limiter_store(kind, redis_url=None):
+    if kind == 'memory':
+        return MemoryLimiterStore()
+    if kind == 'redis':
+        return RedisLimiterStore(redis_url or 'redis://localhost:6379/0')
+    raise ValueError(f"Unknown limiter store: {kind}")
+
+
+class AdmissionController:
+    """
+    Admission control for routes that call slow, paid upstreams.
+
+    Each request first takes a token from its user's bucket for the upstream,
+    then waits in a bounded queue for one of the upstream's concurrency slots.
+    The token is given back if the request doesn't get a slot.
+    Rejections raise AdmissionRejected, which carries a Retry-After hint.
+    """
+
+    def __init__(self, store, limits):
+        self.store = store
+        self.limits = limits  # upstream name -> UpstreamLimit
+        self._counters = {name: Counter() for name in limits}
+        self._lock = threading.Lock()
+
+    def limit(self, upstream):
+        """Decorator for a route calling the upstream. Apply it below login_required."""
+        upstream_limit = self.limits[upstream]
+
+        def decorator(f):
+            @wraps(f)
+            def decorated_function(*args, **kwargs):
+                client = session.get('user', {}).get('id') or request.remote_addr
+                bucket = f"{upstream}:{client}"
+                allowed, retry_after = self.store.take_token(bucket, upstream_limit.rate, upstream_limit.burst)
+                if not allowed:
+                    self._count(upstream, 'rate_limited')
+                    raise AdmissionRejected(upstream, 'rate_limited', retry_after)
+
+                try:
+                    token = self.store.acquire_slot(upstream, upstream_limit.max_concurrency,
+                                                    upstream_limit.max_waiting, upstream_limit.wait_timeout)
+                except AdmissionRejected as e:
+                    self.store.refund_token(bucket, upstream_limit.rate, upstream_limit.burst)
+                    self._count(upstream, e.reason)
+                    raise
+                self._count(upstream, 'admitted')
+                try:
+                    return f(*args, **kwargs)
+                finally:
+                    self.store.release_slot(upstream, token)
+            return decorated_function
+        return decorator
+
+    def stats(self):
+        stats = {}
+        for name, upstream_limit in self.limits.items():
+            in_flight, waiting = self.store.slot_usage(name)
+            with self._lock:
+                counters = dict(self._counters[name])
+            stats[name] = {
+                'in_flight': in_flight,
+                'waiting': waiting,
+                'max_concurrency': upstream_limit.max_concurrency,
+                'max_waiting': upstream_limit.max_waiting,
+                'admitted': counters.get('admitted', 0),
+                'rate_limited': counters.get('rate_limited', 0),
+                'queue_full': counters.get('queue_full', 0),
+                'timeout': counters.get('timeout', 0),
+            }
+        return stats
+
+    def _count(self, upstream, event):
+        with self._lock:
+            self._counters[upstream][event] += 1
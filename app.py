@@ -2,21 +2,84 @@ import os
 from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
 from dotenv import load_dotenv
 import os
-from flask import Flask, render_template, request, redirect, url_for, session, flash, jsonify
+from flask import Flask, Response, render_template, request, redirect, url_for, session, flash, jsonify, make_response, abort
+from markupsafe import Markup
 from dotenv import load_dotenv
 from functools import wraps
+import hashlib
+import io
+import time
 import uuid
-from datetime import datetime
+from datetime import datetime, timezone
+
+import click
 
 from stt_service import STTService
+from admission import AdmissionController, AdmissionRejected, UpstreamLimit, create_limiter_store
+from assets import AssetPipeline
+from fragment_cache import FragmentCache
+from search_index import SearchIndex
+from write_coalescer import WriteCoalescer
 import models
 import llm_service
+import export_service
+import import_service
+import route_planner
 
 load_dotenv()
 
 # --- App and Server Setup ---
 app = Flask(__name__)
 app.secret_key = os.urandom(24)
+assets = AssetPipeline(app)
+
+# Rendered itineraries (_plan_view.html), keyed by plan id and version
+plan_view_cache = FragmentCache(max_bytes=int(os.environ.get("PLAN_VIEW_CACHE_BYTES", 16 * 1024 * 1024)))
+models.add_plan_change_listener(plan_view_cache.invalidate)
+
+search_index = SearchIndex()
+models.add_plan_change_listener(search_index.on_plan_changed)
+SEARCH_PAGE_SIZE = 10
+
+@app.before_first_request
+def start_search_index():
+    # Only processes that serve requests (not the CLI commands) update the index in the background
+    search_index.start()
+
+# Inline edits arriving within the window are merged per item and written together
+item_write_coalescer = WriteCoalescer(models.bulk_update_itinerary_items, window=0.05)
+
+# Server-side travel distances: (name, city) -> coordinates, geocoded by AMap
+# (or the offline stub with GEOCODER=stub). The AMap REST API needs its own web
+# service key; AMAP_KEY is the map's JS API key and is rejected there.
+GEOCODER = os.environ.get("GEOCODER", "amap")
+AMAP_WEB_SERVICE_KEY = os.environ.get("AMAP_WEB_SERVICE_KEY")
+if GEOCODER == "amap" and not AMAP_WEB_SERVICE_KEY:
+    print("Warning: AMAP_WEB_SERVICE_KEY is not set, route distances and optimization are disabled. "
+          "Set it to an AMap web service key, or set GEOCODER=stub for offline use.")
+    coordinate_cache = None
+else:
+    coordinate_cache = route_planner.CoordinateCache(route_planner.create_geocoder(GEOCODER, amap_key=AMAP_WEB_SERVICE_KEY))
+ROUTE_OPTIMIZATION_DISABLED = "Route optimization is not configured on this server (AMAP_WEB_SERVICE_KEY)."
+
+# Admission control for the paid upstreams: per-user token buckets plus a
+# bounded queue for each upstream's concurrency slots
+admission = AdmissionController(
+    create_limiter_store(os.environ.get("ADMISSION_STORE", "memory"), os.environ.get("REDIS_URL")),
+    {
+        'deepseek': UpstreamLimit(rate=1 / 20, burst=3,
+                                  max_concurrency=int(os.environ.get("DEEPSEEK_MAX_CONCURRENCY", 4)),
+                                  max_waiting=8, wait_timeout=30),
+        'baidu_asr': UpstreamLimit(rate=1 / 2, burst=5,
+                                   max_concurrency=int(os.environ.get("BAIDU_ASR_MAX_CONCURRENCY", 8)),
+                                   max_waiting=16, wait_timeout=10),
+    },
+)
+
+# Lazy day loading: days rendered with the page, and per request of /plan/<id>/days
+INITIAL_DAY_COUNT = 3
+DAY_PAGE_SIZE = 3
+MAX_DAY_PAGE_SIZE = 31
 
 def _create_plan_object_from_dict(plan_data: dict) -> models.TravelPlan:
     """Converts a dictionary (from LLM) to a TravelPlan object."""
@@ -58,6 +121,69 @@ def _create_plan_object_from_dict(plan_data: dict) -> models.TravelPlan:
     )
     return plan
 
+# --- Conditional GET ---
+# Pages also depend on the templates and static assets, so validators are salted
+# with their contents (or RELEASE_ID when set): every worker of a deploy agrees
+# on them, and a deploy that changes the pages invalidates every cached copy.
+def _deploy_etag_salt():
+    release_id = os.environ.get("RELEASE_ID")
+    if release_id:
+        return release_id
+    root = os.path.dirname(os.path.abspath(__file__))
+    digest = hashlib.sha1()
+    for folder in ('templates', 'static'):
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, folder)):
+            dirnames.sort()
+            for filename in sorted(filenames):
+                path = os.path.join(dirpath, filename)
+                digest.update(os.path.relpath(path, root).encode('utf-8'))
+                with open(path, 'rb') as f:
+                    digest.update(f.read())
+    return digest.hexdigest()
+
+_etag_salt = _deploy_etag_salt()
+
+def _page_etag(*parts):
+    key = '|'.join(str(part) for part in (_etag_salt,) + parts)
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+def _not_modified(etag, last_modified):
+    """Returns a 304 response if the client's copy matches etag, otherwise None."""
+    if '_flashes' in session:
+        # The flash messages still have to be rendered
+        return None
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    elif request.if_modified_since and last_modified:
+        fresh = _http_date(last_modified) <= request.if_modified_since
+    else:
+        fresh = False
+    if not fresh:
+        return None
+    return _with_validators(app.response_class(status=304), etag, last_modified)
+
+def _conditional_render(etag, last_modified, template, **context):
+    """Renders template and attaches validators, unless the page shows one-off flash messages."""
+    had_flashes = '_flashes' in session
+    response = make_response(render_template(template, **context))
+    if had_flashes:
+        response.headers['Cache-Control'] = 'no-store'
+        return response
+    return _with_validators(response, etag, last_modified)
+
+def _with_validators(response, etag, last_modified):
+    response.set_etag(etag, weak=True)
+    if last_modified:
+        response.last_modified = _http_date(last_modified)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
+
+def _http_date(value):
+    # HTTP dates have second resolution and are always UTC
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.astimezone(timezone.utc).replace(microsecond=0)
+
 # --- Flask Routes ---
 @app.context_processor
 def inject_supabase_keys():
@@ -84,9 +210,8 @@ def login():
         email = request.form.get('email')
         password = request.form.get('password')
         try:
-            user_response = models.supabase.auth.sign_in_with_password({"email": email, "password": password})
-            user_data = user_response.user
-            session['user'] = {'id': user_data.id, 'email': user_data.email}
+            user = models.sign_in_with_password(email, password)
+            session['user'] = user.to_dict()
             return redirect(url_for('index'))
         except Exception as e:
             flash(f"Login failed: {e}", "danger")
@@ -101,7 +226,7 @@ def register():
         email = request.form.get('email')
         password = request.form.get('password')
         try:
-            res = models.supabase.auth.sign_up({"email": email, "password": password})
+            models.sign_up(email, password)
             flash("Registration successful! You can now log in.", "success")
             return redirect(url_for('login'))
         except Exception as e:
@@ -113,30 +238,109 @@ def register():
 @login_required
 def my_plans():
     user_id = session['user']['id']
-    plans = models.get_plans_by_user(user_id)
-    return render_template('my_plans.html', plans=plans)
+    # The list only shows plan rows, so the summaries double as the version lookup
+    plans = models.get_plan_summaries_by_user(user_id)
+    etag = _page_etag('my-plans', user_id, *(f"{plan.id}@{plan.updated_at.timestamp()}" for plan in plans))
+    last_modified = max((plan.updated_at for plan in plans), default=None)
+    not_modified = _not_modified(etag, last_modified)
+    if not_modified:
+        return not_modified
+    return _conditional_render(etag, last_modified, 'my_plans.html', plans=plans)
+
+@app.route('/search')
+@login_required
+def search_route():
+    query = request.args.get('q', '').strip()
+    page = max(request.args.get('page', 1, type=int), 1)
+    results, total = [], 0
+    if query:
+        results, total = search_index.search(session['user']['id'], query, page=page, per_page=SEARCH_PAGE_SIZE)
+    return render_template('search.html', query=query, results=results, total=total, page=page, per_page=SEARCH_PAGE_SIZE)
 
 @app.route('/plan/<plan_id>')
 @login_required
 def view_plan(plan_id):
-    plan = models.get_plan(plan_id)
-    if not plan or plan.user_id != session['user']['id']:
+    user_id = session['user']['id']
+    summary = models.get_plan_summary(plan_id)
+    if not summary or summary.user_id != user_id:
         flash("Plan not found or you don't have access.", "danger")
         return redirect(url_for('my_plans'))
 
+    version = summary.updated_at.timestamp()
+    etag = _page_etag('plan', user_id, plan_id, version)
+    not_modified = _not_modified(etag, summary.updated_at)
+    if not_modified:
+        return not_modified
+
+    # The itinerary only depends on the plan itself, so a cached fragment spares
+    # both the nested fetch and the render; the page around it (flashes, nav) is
+    # always rendered fresh.
+    plan_view_html = plan_view_cache.get(plan_id, version)
+    if plan_view_html is None:
+        # Only the first days are rendered up front; the rest are loaded while scrolling
+        plan = summary
+        plan.days, total_days = models.get_days(plan_id, 0, INITIAL_DAY_COUNT)
+        next_day_offset = len(plan.days) if len(plan.days) < total_days else None
+        cost_totals = models.get_plan_cost_totals(plan_id)
+        # Only the render is timed, so the saved-time metric doesn't include queries
+        start = time.perf_counter()
+        plan_view_html = _render_plan_view(plan, is_details_view=True, cost_totals=cost_totals, next_day_offset=next_day_offset)
+        plan_view_cache.put(plan_id, version, plan_view_html, render_seconds=time.perf_counter() - start)
+
+    return _conditional_render(etag, summary.updated_at, 'plan_details.html', plan=summary, plan_view_html=Markup(plan_view_html))
+
+@app.route('/plan/<plan_id>/days')
+@login_required
+def plan_days_api(plan_id):
+    summary = models.get_plan_summary(plan_id)
+    if not summary or summary.user_id != session['user']['id']:
+        return jsonify({'error': "Plan not found or you don't have access."}), 404
+
+    offset = max(request.args.get('offset', 0, type=int), 0)
+    limit = min(max(request.args.get('limit', DAY_PAGE_SIZE, type=int), 1), MAX_DAY_PAGE_SIZE)
+    days, total_days = models.get_days(plan_id, offset, limit)
+    next_offset = offset + len(days) if days and offset + len(days) < total_days else None
+
+    html = ''.join(render_template('_plan_day.html', day=day, plan=summary, is_details_view=True) for day in days)
+    return jsonify({
+        'days': [day.to_dict() for day in days],
+        'html': html,
+        'location_city_map': _location_city_map(days),
+        'next_offset': next_offset,
+        'total': total_days,
+    })
+
+def _location_city_map(days):
     # Create location-city map for the frontend
     location_city_map = {}
-    for day in plan.days:
+    for day in days:
         for item in day.items:
             if item.location and item.location.name and item.location.city:
                 location_city_map[item.location.name] = item.location.city
+    return location_city_map
+
+def _render_plan_view(plan, is_details_view, cost_totals=None, next_day_offset=None):
+    """
+    Renders the itinerary for plan.days. cost_totals covers the whole plan when only
+    some days are loaded; next_day_offset enables lazy loading of the remaining days.
+    """
+    if cost_totals is None:
+        cost_totals = (
+            sum(item.estimated_cost or 0.0 for day in plan.days for item in day.items),
+            sum(cost.amount or 0.0 for day in plan.days for item in day.items for cost in item.actual_costs),
+        )
 
     amap_key = os.environ.get("AMAP_KEY")
     amap_security_key = os.environ.get("AMAP_SECURITY_KEY")
-    return render_template('plan_details.html', plan=plan, is_details_view=True, amap_key=amap_key, amap_security_key=amap_security_key, location_city_map=location_city_map)
+    return render_template('_plan_view.html', plan=plan, is_details_view=is_details_view,
+                           amap_key=amap_key, amap_security_key=amap_security_key,
+                           location_city_map=_location_city_map(plan.days),
+                           total_estimated_cost=cost_totals[0], total_actual_cost=cost_totals[1],
+                           next_day_offset=next_day_offset)
 
 @app.route('/generate-plan', methods=['POST'])
 @login_required
+@admission.limit('deepseek')
 def generate_plan_route():
     query = request.form.get('query')
     if not query:
@@ -153,19 +357,11 @@ def generate_plan_route():
     # Convert dictionary to TravelPlan object
     plan = _create_plan_object_from_dict(plan_data)
 
-    # Create location-city map for the frontend
-    location_city_map = {}
-    for day in plan.days:
-        for item in day.items:
-            if item.location and item.location.name and item.location.city:
-                location_city_map[item.location.name] = item.location.city
-    
     # Store plan in session to be able to save it later
     session['generated_plan'] = plan.to_dict()
-    
-    amap_key = os.environ.get("AMAP_KEY")
-    amap_security_key = os.environ.get("AMAP_SECURITY_KEY")
-    return render_template('plan_result.html', plan=plan, is_details_view=False, amap_key=amap_key, amap_security_key=amap_security_key, location_city_map=location_city_map)
+
+    # Generated plans live in the session only, so they are rendered in full
+    return render_template('plan_result.html', plan=plan, plan_view_html=Markup(_render_plan_view(plan, is_details_view=False)))
 
 @app.route('/save-plan', methods=['POST'])
 @login_required
@@ -260,6 +456,35 @@ def update_itinerary_item_route(item_id):
         updates = request.json
         updated_item = models.update_itinerary_item(item_id, updates)
         return jsonify({'success': True, 'item': updated_item})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 500
+
+@app.route('/itinerary-items/batch-update', methods=['POST'])
+@login_required
+def batch_update_itinerary_items_route():
+    """
+    Expects {"updates": [{"id": ..., <fields>...}]}. Concurrent edits of the same
+    item are merged; for each field the one that arrived last wins. The response
+    carries the merged state of every item and, under "superseded", the fields of
+    this request that a later edit overwrote before they were written.
+    """
+    data = request.get_json(silent=True)
+    if not isinstance(data, dict):
+        return jsonify({'success': False, 'error': 'Expected a JSON object with "updates"'}), 400
+    try:
+        updates = [(update['id'], models.clean_item_update(update)) for update in data.get('updates', [])]
+    except (AttributeError, KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'Invalid update: {e}'}), 400
+
+    owners = models.user_ids_for_items({item_id for item_id, _ in updates})
+    if any(owners.get(item_id) != session['user']['id'] for item_id, _ in updates):
+        return jsonify({'success': False, 'error': "Item not found or you don't have access."}), 404
+
+    try:
+        items, superseded = item_write_coalescer.update(updates)
+        return jsonify({'success': True, 'items': items, 'superseded': superseded})
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
@@ -284,15 +509,180 @@ def insert_and_reorder_route(day_id):
             models.insert_itinerary_item(day_id, new_item_data)
 
         if items_to_update:
-            for item_update in items_to_update:
-                models.update_itinerary_item(item_update['id'], {'order': item_update['order']})
+            models.bulk_update_itinerary_items({item_update['id']: models.clean_item_update({'order': item_update['order']})
+                                                for item_update in items_to_update})
 
         return jsonify({'success': True})
+    except ValueError as e:
+        return jsonify({'success': False, 'error': str(e)}), 400
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 
 
+@app.route('/plan/<plan_id>/distances')
+@login_required
+def plan_distances_api(plan_id):
+    """
+    Straight-line distances (km) between all items of each day of the plan. Items
+    without coordinates are counted per day; "geocoding_failed" tells whether that
+    is because the geocoder was unavailable.
+    """
+    plan = models.get_plan(plan_id)
+    if not plan or plan.user_id != session['user']['id']:
+        return jsonify({'error': "Plan not found or you don't have access."}), 404
+    if coordinate_cache is None:
+        return jsonify({'error': ROUTE_OPTIMIZATION_DISABLED}), 503
+    days, geocoding_failed = route_planner.plan_distances(plan, coordinate_cache)
+    return jsonify({'days': days, 'geocoding_failed': geocoding_failed})
+
+@app.route('/plan/<plan_id>/optimize-route', methods=['POST'])
+@login_required
+def optimize_route(plan_id):
+    """
+    Reorders the items of the plan's days (or of {"day_ids": [...]}) to shorten the
+    travel between them. Hotels, fixed-time items and {"fixed_item_ids": [...]} stay
+    in place, and moved items take their times along, as do items without
+    coordinates (counted per day as "unlocated_items"; "geocoding_failed" tells
+    whether the geocoder was unavailable). {"dry_run": true} only reports the new
+    orders.
+    """
+    plan = models.get_plan(plan_id)
+    if not plan or plan.user_id != session['user']['id']:
+        return jsonify({'success': False, 'error': "Plan not found or you don't have access."}), 404
+    if coordinate_cache is None:
+        return jsonify({'success': False, 'error': ROUTE_OPTIMIZATION_DISABLED}), 503
+
+    data = request.get_json(silent=True) or {}
+    day_ids = set(data.get('day_ids') or [day.id for day in plan.days])
+    fixed_item_ids = set(data.get('fixed_item_ids') or [])
+
+    updates = {}
+    days = []
+    matrices, geocoding_failed = route_planner.day_distance_matrices(plan, coordinate_cache)
+    for day, distances in matrices:
+        if day.id not in day_ids:
+            continue
+        current = list(range(len(day.items)))
+        order = route_planner.optimize_day_order(day.items, distances, fixed_item_ids)
+        before = route_planner.route_length(distances, current)
+        after = route_planner.route_length(distances, order)
+        # Keep the LLM's order unless the route actually gets shorter
+        if after >= before - 1e-6:
+            order, after = current, before
+        if order != current:
+            for position, index in enumerate(order):
+                if day.items[index].order != position:
+                    updates.setdefault(day.items[index].id, {})['order'] = position
+            for item_id, (start_time, end_time) in route_planner.retime(day.items, order).items():
+                updates.setdefault(item_id, {}).update(start_time=start_time.isoformat(), end_time=end_time.isoformat())
+        days.append({
+            'day_id': day.id,
+            'item_ids': [day.items[index].id for index in order],
+            'changed': order != current,
+            'before_km': round(before, 3),
+            'after_km': round(after, 3),
+            'unlocated_items': route_planner.unlocated_items(distances),
+        })
+
+    if updates and not data.get('dry_run'):
+        models.bulk_update_itinerary_items(updates)
+    return jsonify({'success': True, 'days': days, 'geocoding_failed': geocoding_failed})
+
+@app.route('/export/plans.<export_format>')
+@login_required
+def export_plans_route(export_format):
+    if export_format not in export_service.EXPORT_FORMATS:
+        abort(404)
+    encode, mimetype = export_service.EXPORT_FORMATS[export_format]
+    # ?after=<plan id> resumes an interrupted export
+    plans = export_service.iter_plans(user_id=session['user']['id'], after=request.args.get('after'))
+    return Response(encode(plans), mimetype=mimetype,
+                    headers={'Content-Disposition': f'attachment; filename=plans.{export_format}'})
+
+@app.cli.command('export-plans')
+@click.option('--user', 'user_id', help="Only export this user's plans (default: all plans).")
+@click.option('--format', 'export_format', type=click.Choice(sorted(export_service.EXPORT_FORMATS)), default='ndjson')
+@click.option('--after', help='Resume after this plan id.')
+@click.option('--batch-size', type=int, default=export_service.EXPORT_BATCH_SIZE, show_default=True)
+@click.option('--output', type=click.File('w', encoding='utf-8'), default='-')
+def export_plans_command(user_id, export_format, after, batch_size, output):
+    """Streams plans as NDJSON or ICS."""
+    encode, _ = export_service.EXPORT_FORMATS[export_format]
+    cursor = {'last': after}
+
+    def track(plans):
+        for plan in plans:
+            yield plan
+            cursor['last'] = plan.id
+
+    try:
+        for chunk in encode(track(export_service.iter_plans(user_id=user_id, after=after, batch_size=batch_size))):
+            output.write(chunk)
+    finally:
+        if cursor['last']:
+            click.echo(f"Last exported plan: {cursor['last']} (resume with --after {cursor['last']})", err=True)
+
+@app.route('/import/plans', methods=['POST'])
+@login_required
+def import_plans_route():
+    if 'file' not in request.files or request.files['file'].filename == '':
+        return jsonify({'error': 'No import file'}), 400
+    file = request.files['file']
+    import_format = request.form.get('format') or os.path.splitext(file.filename)[1].lstrip('.').lower()
+    if import_format not in import_service.IMPORT_FORMATS:
+        return jsonify({'error': f'Unsupported import format: {import_format}'}), 400
+
+    stream = io.TextIOWrapper(file.stream, encoding='utf-8-sig', newline='')
+    report = import_service.import_plans(stream, import_format, session['user']['id'],
+                                         dry_run=request.form.get('dry_run') == 'true')
+    return jsonify(report.to_dict())
+
+@app.cli.command('import-plans')
+@click.argument('file', type=click.File('r', encoding='utf-8-sig'))
+@click.option('--user', 'user_id', required=True, help='Owner of the imported plans.')
+@click.option('--format', 'import_format', type=click.Choice(import_service.IMPORT_FORMATS),
+              help='Defaults to the file extension.')
+@click.option('--chunk-size', type=int, default=import_service.IMPORT_CHUNK_SIZE, show_default=True)
+@click.option('--dry-run', is_flag=True, help='Only validate the file.')
+def import_plans_command(file, user_id, import_format, chunk_size, dry_run):
+    """Imports plans, items and actual costs from NDJSON or CSV."""
+    import_format = import_format or os.path.splitext(file.name)[1].lstrip('.').lower()
+    if import_format not in import_service.IMPORT_FORMATS:
+        raise click.UsageError(f'Unsupported import format: {import_format}')
+
+    start = time.perf_counter()
+    report = import_service.import_plans(file, import_format, user_id, dry_run=dry_run, chunk_size=chunk_size)
+    elapsed = time.perf_counter() - start
+    for line, error in report.errors:
+        click.echo(f"line {line}: {error}", err=True)
+    click.echo(f"{'Validated' if dry_run else 'Imported'} {report.plans} plans, {report.items} items, {report.costs} costs "
+               f"from {report.rows} rows in {elapsed:.2f}s ({report.rows / elapsed if elapsed else 0:.0f} rows/s), "
+               f"{len(report.errors)} errors")
+
+@app.errorhandler(AdmissionRejected)
+def admission_rejected(e):
+    if e.reason == 'rate_limited':
+        message = f"Too many requests. Please try again in {e.retry_after} seconds."
+    else:
+        message = f"The service is busy. Please try again in {e.retry_after} seconds."
+    if request.endpoint == 'generate_plan_route':
+        # The index page reloads on errors to show flash messages
+        flash(message, "warning")
+    response = jsonify({'error': message})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response
+
+@app.route('/metrics')
+def metrics():
+    return jsonify({
+        'plan_view_cache': plan_view_cache.stats(),
+        'admission': admission.stats(),
+        'item_write_coalescer': item_write_coalescer.stats(),
+        'coordinate_cache': coordinate_cache.stats() if coordinate_cache else None,
+    })
+
 @app.route('/logout')
 def logout():
     session.pop('user', None)
@@ -301,6 +691,7 @@ def logout():
 
 @app.route('/transcribe', methods=['POST'])
 @login_required
+@admission.limit('baidu_asr')
 def transcribe_audio():
     if 'audio_file' not in request.files:
         return jsonify({'error': 'No audio file part'}), 400
@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import mimetypes
+import os
+
+from flask import current_app, request
+
+try:
+    import brotli
+except ImportError:  # in requirements.txt; without it only gzip variants are built
+    brotli = None
+
+# Static files worth compressing; images, audio and fonts are already compressed
+COMPRESSIBLE_ASSET_EXTENSIONS = {'.css', '.js', '.json', '.svg', '.txt', '.html', '.map'}
+# Dynamic responses that are gzipped on the fly
+COMPRESSIBLE_RESPONSE_TYPES = {'text/html', 'application/json'}
+IMMUTABLE_CACHE_CONTROL = 'public, max-age=31536000, immutable'
+
+
+class Asset:
+    """A static file with its content hash and precompressed variants."""
+
+    def __init__(self, filename, content):
+        self.filename = filename
+        self.digest = hashlib.sha256(content).hexdigest()[:12]
+        root, ext = os.path.splitext(filename)
+        self.hashed_filename = f"{root}.{self.digest}{ext}"
+        self.mimetype = mimetypes.guess_type(filename)[0] or 'application/octet-stream'
+        self.variants = {None: content}
+        if ext in COMPRESSIBLE_ASSET_EXTENSIONS:
+            self._add_variant('gzip', gzip.compress(content, compresslevel=9, mtime=0))
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(content, quality=11))
+
+    def _add_variant(self, encoding, body):
+        if len(body) < len(self.variants[None]):
+            self.variants[encoding] = body
+
+    def negotiate(self, accept_encodings):
+        """Returns the (encoding, body) pair best suited to the client's Accept-Encoding."""
+        for encoding in ('br', 'gzip'):
+            if encoding in self.variants and accept_encodings[encoding]:
+                return encoding, self.variants[encoding]
+        return None, self.variants[None]
+
+
+class AssetPipeline:
+    """
+    A build-free asset pipeline for Flask.
+
+    At startup every file under the static folder is hashed and precompressed in
+    memory. url_for('static', filename=...) then points at the fingerprinted name
+    (css/app.<hash>.css), which is served with immutable cache headers and the
+    best encoding the client accepts. HTML and JSON responses above
+    compress_min_size bytes are gzipped on the way out.
+    """
+
+    def __init__(self, app=None, compress_min_size=1024):
+        self.compress_min_size = compress_min_size
+        self.assets = {}  # original filename -> Asset
+        self._by_hashed_filename = {}
+        if app is not None:
+            self.init_app(app)
+
+    def init_app(self, app):
+        if app.static_folder:
+            self.build(app.static_folder)
+        app.url_defaults(self._fingerprint_static_url)
+        app.view_functions['static'] = self.serve
+        app.after_request(self.compress_response)
+
+    def build(self, static_folder):
+        self.assets = {}
+        for dirpath, _, filenames in os.walk(static_folder):
+            for name in filenames:
+                path = os.path.join(dirpath, name)
+                filename = os.path.relpath(path, static_folder).replace(os.sep, '/')
+                with open(path, 'rb') as fp:
+                    self.assets[filename] = Asset(filename, fp.read())
+        self._by_hashed_filename = {asset.hashed_filename: asset for asset in self.assets.values()}
+
+    def _fingerprint_static_url(self, endpoint, values):
+        if endpoint != 'static':
+            return
+        asset = self.assets.get(values.get('filename'))
+        if asset is not None:
+            values['filename'] = asset.hashed_filename
+
+    def serve(self, filename):
+        asset = self._by_hashed_filename.get(filename)
+        if asset is None:
+            # Unfingerprinted (or stale) URLs keep working through the regular static view
+            return current_app.send_static_file(filename)
+
+        encoding, body = asset.negotiate(request.accept_encodings)
+        response = current_app.response_class(body, mimetype=asset.mimetype)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+        response.vary.add('Accept-Encoding')
+        response.headers['Cache-Control'] = IMMUTABLE_CACHE_CONTROL
+        response.set_etag(f"{asset.digest}-{encoding}" if encoding else asset.digest)
+        return response.make_conditional(request)
+
+    def compress_response(self, response):
+        if (response.status_code < 200 or response.status_code in (204, 304)
+                or response.direct_passthrough or response.is_streamed
+                or 'Content-Encoding' in response.headers
+                or response.mimetype not in COMPRESSIBLE_RESPONSE_TYPES):
+            return response
+        response.vary.add('Accept-Encoding')
+        if not request.accept_encodings['gzip']:
+            return response
+        body = response.get_data()
+        if len(body) < self.compress_min_size:
+            return response
+        response.set_data(gzip.compress(body, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+        return response
@@ -0,0 +1,94 @@
+import json
+from datetime import timezone
+
+import models
+
+# Plans fetched per query while exporting; memory use is bounded by one batch
+EXPORT_BATCH_SIZE = 50
+
+ICS_PRODID = '-//AI Travel Planner//Plan Export//EN'
+
+
+def iter_plans(user_id=None, after=None, batch_size=EXPORT_BATCH_SIZE):
+    """
+    Yields full plans ordered by id, fetching them batch_size at a time.
+
+    Args:
+        user_id: Only export this user's plans. None exports every plan.
+        after: Resume cursor; only plans with an id greater than this are yielded.
+    """
+    while True:
+        batch = models.get_plans_page(user_id=user_id, after=after, limit=batch_size)
+        yield from batch
+        if len(batch) < batch_size:
+            return
+        after = batch[-1].id
+
+
+def ndjson_lines(plans):
+    """Encodes each plan as one JSON line. A line's "id" is the cursor to resume after it."""
+    for plan in plans:
+        yield json.dumps(plan.to_dict(), ensure_ascii=False) + '\n'
+
+
+def ics_lines(plans):
+    """Encodes the itinerary items of the plans as an iCalendar (RFC 5545) stream."""
+    yield from _ics_content_lines(['BEGIN:VCALENDAR', 'VERSION:2.0', f'PRODID:{ICS_PRODID}', 'CALSCALE:GREGORIAN'])
+    for plan in plans:
+        for day in plan.days:
+            for item in day.items:
+                yield from _ics_content_lines(_ics_event(plan, day, item))
+    yield from _ics_content_lines(['END:VCALENDAR'])
+
+
+EXPORT_FORMATS = {
+    'ndjson': (ndjson_lines, 'application/x-ndjson'),
+    'ics': (ics_lines, 'text/calendar'),
+}
+
+
+def _ics_event(plan, day, item):
+    stamp = plan.updated_at.astimezone(timezone.utc).strftime('%Y%m%dT%H%M%SZ')
+    lines = ['BEGIN:VEVENT', f'UID:{item.id}@ai-travel-planner', f'DTSTAMP:{stamp}']
+    # Item times are shown to users as entered (local to the trip), so they are
+    # exported as floating times rather than converted to UTC
+    if item.start_time:
+        lines.append(f"DTSTART:{item.start_time.strftime('%Y%m%dT%H%M%S')}")
+        if item.end_time:
+            lines.append(f"DTEND:{item.end_time.strftime('%Y%m%dT%H%M%S')}")
+    else:
+        lines.append(f"DTSTART;VALUE=DATE:{day.date.strftime('%Y%m%d')}")
+    lines.append(f"SUMMARY:{_ics_escape(f'{item.item_type}: {item.description}')}")
+    if item.location:
+        where = f'{item.location.city}, {item.location.name}' if item.location.city else item.location.name
+        lines.append(f'LOCATION:{_ics_escape(where)}')
+    lines.append(f"DESCRIPTION:{_ics_escape(f'{plan.title} - 预计花费: {item.estimated_cost or 0.0:.2f}')}")
+    lines.append(f'CATEGORIES:{_ics_escape(item.item_type or "")}')
+    lines.append('END:VEVENT')
+    return lines
+
+
+def _ics_escape(text):
+    return (text or '').replace('\\', '\\\\').replace(';', '\\;').replace(',', '\\,').replace('\r\n', '\\n').replace('\n', '\\n')
+
+
+def _ics_content_lines(lines):
+    for line in lines:
+        yield _ics_fold(line) + '\r\n'
+
+
+def _ics_fold(line):
+    # Content lines are limited to 75 octets; continuation lines start with a space.
+    # Folding happens on character boundaries so multi-byte characters stay intact.
+    if len(line.encode('utf-8')) <= 75:
+        return line
+    parts, current, size, limit = [], '', 0, 75
+    for char in line:
+        char_size = len(char.encode('utf-8'))
+        if size + char_size > limit:
+            parts.append(current)
+            current, size, limit = '', 0, 74
+        current += char
+        size += char_size
+    parts.append(current)
+    return '\r\n '.join(parts)
@@ -0,0 +1,86 @@
+import threading
+from collections import OrderedDict
+
+
+class FragmentCache:
+    """
+    An LRU cache for rendered HTML fragments, bounded by their total size in bytes.
+
+    Entries are grouped (e.g. by plan id) so that everything belonging to a group
+    can be dropped at once when the underlying data changes. Each entry remembers
+    how long it took to render, so hits can report the render time they saved.
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()  # (group, key) -> (html, size, render_seconds)
+        self._groups = {}  # group -> set of keys
+        self._size = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.render_seconds_saved = 0.0
+
+    def get(self, group, key):
+        """Returns the cached fragment, or None on a miss."""
+        with self._lock:
+            entry = self._entries.get((group, key))
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end((group, key))
+            self.hits += 1
+            self.render_seconds_saved += entry[2]
+            return entry[0]
+
+    def put(self, group, key, html, render_seconds=0.0):
+        size = len(html.encode('utf-8'))
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._remove((group, key))
+            self._entries[(group, key)] = (html, size, render_seconds)
+            self._groups.setdefault(group, set()).add(key)
+            self._size += size
+            while self._size > self.max_bytes:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                self.evictions += 1
+
+    def invalidate(self, group):
+        """Drops every fragment of the group."""
+        with self._lock:
+            for key in list(self._groups.get(group, ())):
+                self._remove((group, key))
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._groups.clear()
+            self._size = 0
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'bytes': self._size,
+                'max_bytes': self.max_bytes,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'render_seconds_saved': round(self.render_seconds_saved, 6),
+                'render_seconds_saved_per_hit': round(self.render_seconds_saved / self.hits, 6) if self.hits else 0.0,
+            }
+
+    def _remove(self, full_key):
+        entry = self._entries.pop(full_key, None)
+        if entry is None:
+            return
+        self._size -= entry[1]
+        group, key = full_key
+        keys = self._groups.get(group)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._groups[group]
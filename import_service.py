@@ -0,0 +1,248 @@
+import csv
+import json
+from datetime import datetime
+
+import models
+
+# Rows written per insert request
+IMPORT_CHUNK_SIZE = 500
+
+IMPORT_FORMATS = ('ndjson', 'csv')
+
+# CSV layout: one row per itinerary item, optionally carrying one actual cost.
+# Rows with the same plan_key (default: the title) form one plan. Rows with the
+# same non-empty item_key within a plan refer to the same item, so further costs
+# can be attached on rows that leave the item columns empty.
+CSV_COLUMNS = (
+    'plan_key', 'title', 'plan_description', 'date',
+    'item_key', 'item_type', 'description', 'start_time', 'end_time', 'location', 'city', 'estimated_cost',
+    'cost_name', 'cost_amount',
+)
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows = 0
+        self.plans = 0
+        self.items = 0
+        self.costs = 0
+        self.errors = []  # (line, message)
+
+    def add_error(self, line, message):
+        self.errors.append((line, message))
+
+    def to_dict(self):
+        return {
+            "rows": self.rows,
+            "plans": self.plans,
+            "items": self.items,
+            "costs": self.costs,
+            "errors": [{"line": line, "error": message} for line, message in self.errors],
+        }
+
+
+def import_plans(stream, import_format, user_id, dry_run=False, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Imports plans, items and actual costs for a user from an NDJSON or CSV text stream.
+
+    Everything is validated in one pass first; a plan is only imported if all of
+    its lines are valid, and the errors are reported per line. The valid plans
+    are then written with a few chunked inserts per table.
+
+    Args:
+        stream: A text stream. NDJSON lines use the export format (see export_service).
+        import_format: 'ndjson' or 'csv'.
+        dry_run: Only validate, don't write anything.
+
+    Returns:
+        An ImportReport.
+    """
+    if import_format not in IMPORT_FORMATS:
+        raise ValueError(f"Unsupported import format: {import_format}")
+
+    report = ImportReport()
+    parse = _parse_ndjson if import_format == 'ndjson' else _parse_csv
+    lines = _LineCounter(stream)
+    try:
+        plans = list(parse(lines, user_id, report))
+    except UnicodeDecodeError as e:
+        # The stream can't be resynchronized after a decoding error, so nothing is imported.
+        # Text streams decode in chunks, so the invalid bytes are at or after this line.
+        report.add_error(lines.line + 1, f"file is not valid UTF-8 at or after this line: {e.reason}")
+        plans = []
+
+    if plans and not dry_run:
+        models.bulk_create_plans(plans, chunk_size=chunk_size)
+
+    report.plans = len(plans)
+    report.items = sum(len(day.items) for plan in plans for day in plan.days)
+    report.costs = sum(len(item.actual_costs) for plan in plans for day in plan.days for item in day.items)
+    return report
+
+
+class _LineCounter:
+    """Iterates a text stream and counts the lines decoded so far."""
+
+    def __init__(self, stream):
+        self.stream = iter(stream)
+        self.line = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        line = next(self.stream)
+        self.line += 1
+        return line
+
+
+def _parse_ndjson(stream, user_id, report):
+    locations = {}
+    for line_number, line in enumerate(stream, start=1):
+        if not line.strip():
+            continue
+        report.rows += 1
+        try:
+            plan_data = json.loads(line)
+            if not isinstance(plan_data, dict):
+                raise ValueError("expected a JSON object")
+            plan = _build_plan(user_id, plan_data.get('title'), plan_data.get('description'))
+            for day_data in plan_data.get('days') or []:
+                day = models.Day(date=_parse_date(day_data.get('date')))
+                for order, item_data in enumerate(day_data.get('items') or []):
+                    location_data = item_data.get('location') or {}
+                    item = _build_item(item_data, location_data.get('name'), location_data.get('city'), locations)
+                    item.order = order
+                    for cost_data in item_data.get('actual_costs') or []:
+                        item.actual_costs.append(_build_cost(cost_data.get('name'), cost_data.get('amount')))
+                    day.items.append(item)
+                plan.days.append(day)
+        except (ValueError, TypeError, AttributeError) as e:
+            report.add_error(line_number, str(e))
+            continue
+        plan.days.sort(key=lambda day: day.date)
+        yield plan
+
+
+def _parse_csv(stream, user_id, report):
+    reader = csv.DictReader(stream)
+    missing = {'title', 'date', 'item_type', 'description'} - set(reader.fieldnames or ())
+    if missing:
+        report.add_error(1, f"missing columns: {', '.join(sorted(missing))}")
+        return
+
+    locations = {}
+    plans = {}  # plan_key -> (plan, {date: day}, {item_key: item})
+    failed = set()
+    for row in reader:
+        # Physical line of the row's end, so quoted newlines and skipped blank lines are counted
+        line_number = reader.line_num
+        report.rows += 1
+        plan_key = (row.get('plan_key') or row.get('title') or '').strip()
+        try:
+            if not plan_key:
+                raise ValueError("title is required")
+            if plan_key not in plans:
+                plans[plan_key] = (_build_plan(user_id, row.get('title'), row.get('plan_description')), {}, {})
+            plan, days, items = plans[plan_key]
+
+            item_key = (row.get('item_key') or '').strip()
+            item = items.get(item_key) if item_key else None
+            if item is None:
+                date = _parse_date(row.get('date'))
+                item = _build_item(row, row.get('location'), row.get('city'), locations)
+                day = days.setdefault(date, models.Day(date=date))
+                item.order = len(day.items)
+                day.items.append(item)
+                if item_key:
+                    items[item_key] = item
+
+            if (row.get('cost_name') or '').strip() or (row.get('cost_amount') or '').strip():
+                item.actual_costs.append(_build_cost(row.get('cost_name'), row.get('cost_amount')))
+        except ValueError as e:
+            report.add_error(line_number, str(e))
+            failed.add(plan_key)
+
+    for plan_key, (plan, days, _) in plans.items():
+        if plan_key in failed:
+            continue
+        plan.days = [days[date] for date in sorted(days)]
+        yield plan
+
+
+def _build_plan(user_id, title, description):
+    title = (title or '').strip()
+    if not title:
+        raise ValueError("title is required")
+    return models.TravelPlan(user_id=user_id, title=title, description=(description or '').strip())
+
+
+def _build_item(fields, location_name, city, locations):
+    item_type = (fields.get('item_type') or '').strip()
+    description = (fields.get('description') or '').strip()
+    if not item_type:
+        raise ValueError("item_type is required")
+    if not description:
+        raise ValueError("description is required")
+
+    start_time = _parse_datetime(fields.get('start_time'), 'start_time')
+    end_time = _parse_datetime(fields.get('end_time'), 'end_time')
+    if start_time and end_time and end_time < start_time:
+        raise ValueError("end_time is before start_time")
+
+    location = None
+    location_name = (location_name or '').strip()
+    if location_name:
+        # Items sharing a (name, city) share one Location, resolved in bulk on write
+        key = (location_name, (city or '').strip() or 'Unknown')
+        location = locations.get(key)
+        if location is None:
+            location = locations[key] = models.Location(name=key[0], city=key[1])
+
+    return models.ItineraryItem(
+        item_type=item_type,
+        description=description,
+        start_time=start_time,
+        end_time=end_time,
+        location=location,
+        estimated_cost=_parse_amount(fields.get('estimated_cost'), 'estimated_cost', default=0.0),
+    )
+
+
+def _build_cost(name, amount):
+    name = (name or '').strip()
+    if not name:
+        raise ValueError("cost_name is required when a cost is given")
+    return models.ActualCost(name=name, amount=_parse_amount(amount, 'cost_amount'))
+
+
+def _parse_date(value):
+    if not value:
+        raise ValueError("date is required")
+    try:
+        return datetime.fromisoformat(str(value).strip()[:10]).date()
+    except ValueError:
+        raise ValueError(f"invalid date: {value!r} (expected YYYY-MM-DD)")
+
+
+def _parse_datetime(value, field):
+    if value is None or not str(value).strip():
+        return None
+    try:
+        return datetime.fromisoformat(str(value).strip())
+    except ValueError:
+        raise ValueError(f"invalid {field}: {value!r} (expected YYYY-MM-DDTHH:MM:SS)")
+
+
+def _parse_amount(value, field, default=None):
+    if value is None or (isinstance(value, str) and not value.strip()):
+        if default is None:
+            raise ValueError(f"{field} is required")
+        return default
+    try:
+        amount = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"invalid {field}: {value!r}")
+    if amount < 0 or amount != amount:
+        raise ValueError(f"invalid {field}: {value!r}")
+    return amount
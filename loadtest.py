@@ -0,0 +1,704 @@
+"""
+Load generator for sizing deployments and catching throughput regressions.
+
+Replays realistic user sessions (register/login, generate, save, view, lazy-load
+days, edit items, add and delete costs, transcribe) against the app, with the
+external services replaced by local fakes that add upstream latency:
+
+- Supabase: the SQLite storage backend plus a simulated round trip per query,
+  and an in-memory stand-in for Supabase Auth
+- The LLM: a client that returns a generated plan after --llm-latency seconds
+- Baidu ASR: a client that returns a fixed transcript after --asr-latency seconds
+
+Each load level (a concurrency, or an arrival rate of sessions per second) runs
+for --step-duration seconds. The report has the throughput and per-route
+latency percentiles of every level and the saturation point: the first level
+where throughput stops growing or errors appear.
+
+    # In-process, closed loop: 1, 2, 4, ... sessions running back to back
+    python loadtest.py run --concurrency 1,2,4,8,16,32
+
+    # Open loop: Poisson arrivals at 1, 2 and 4 sessions/s, at most 64 at a time
+    python loadtest.py run --arrival-rate 1,2,4 --concurrency 64
+
+    # Against a real server running on the fakes, to compare serving configurations
+    LOADTEST_LLM_LATENCY=5 gunicorn -w 4 --threads 8 'loadtest:create_app()'
+    python loadtest.py run --target http://127.0.0.1:8000 --concurrency 8,16,32
+
+    # Regression check: fail if peak throughput dropped by more than 10%
+    python loadtest.py run --output current.json --baseline baseline.json
+"""
+import gzip
+import io
+import json
+import os
+import queue
+import random
+import re
+import tempfile
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import date, datetime, timedelta
+from http.cookiejar import CookieJar
+from types import SimpleNamespace
+from urllib import error, parse, request as urllib_request
+
+import click
+
+try:
+    import brotli
+except ImportError:  # br responses couldn't be decoded, so they aren't asked for
+    brotli = None
+
+ROUTES = ['register', 'login', 'index', 'generate', 'save', 'my_plans', 'view_plan', 'plan_days',
+          'edit_items', 'add_cost', 'delete_cost', 'transcribe', 'logout']
+
+PLAN_LINK = re.compile(r'/plan/([0-9a-f-]{36})"')
+ITEM_ID = re.compile(r'id="item-([0-9a-f-]{36})"')
+
+PASSWORD = 'loadtest-password'
+
+# Sent with every request, like a browser, so responses are compressed as they would be in production
+BROWSER_HEADERS = {
+    'Accept': 'text/html,application/json;q=0.9,*/*;q=0.8',
+    'Accept-Encoding': 'gzip, br' if brotli is not None else 'gzip',
+    'Accept-Language': 'zh-CN,zh;q=0.9',
+}
+
+# --- Fakes ---
+
+class FakeLatency:
+    """A mean delay with uniform jitter of +/- jitter * mean."""
+
+    def __init__(self, mean, jitter=0.5):
+        self.mean = mean
+        self.jitter = jitter
+
+    def sleep(self):
+        if self.mean > 0:
+            time.sleep(self.mean * random.uniform(1 - self.jitter, 1 + self.jitter))
+
+
+class FakeSupabaseRepository:
+    """
+    Wraps a storage repository so that every call pays a simulated network round
+    trip. Supabase Auth is replaced by a stateless stand-in (the real one hashes
+    passwords remotely, which the app never pays for): every email has a fixed
+    user id and the password PASSWORD, so any number of worker processes agree.
+    """
+
+    def __init__(self, repository, latency):
+        self._repository = repository
+        self._latency = latency
+
+    def sign_up(self, email, password):
+        return self.sign_in(email, password)
+
+    def sign_in(self, email, password):
+        self._latency.sleep()
+        if password != PASSWORD:
+            raise Exception("Invalid login credentials")
+        return str(uuid.uuid5(uuid.NAMESPACE_URL, f"mailto:{email}")), email
+
+    def __getattr__(self, name):
+        attr = getattr(self._repository, name)
+        if not callable(attr):
+            return attr
+
+        def call(*args, **kwargs):
+            self._latency.sleep()
+            return attr(*args, **kwargs)
+        return call
+
+
+FAKE_CITIES = {
+    '杭州': ['西湖', '灵隐寺', '河坊街', '西溪湿地', '雷峰塔', '龙井村', '宋城', '杭州东站'],
+    '南京': ['夫子庙', '中山陵', '玄武湖', '总统府', '南京博物院', '老门东', '鸡鸣寺', '南京南站'],
+    '成都': ['宽窄巷子', '锦里', '大熊猫基地', '武侯祠', '春熙路', '杜甫草堂', '人民公园', '成都东站'],
+}
+FAKE_ITEM_TYPES = ['Activity', 'Meal', 'Activity', 'Transportation', 'Meal']
+
+
+def fake_plan(query):
+    """A plan in the LLM's output format, derived deterministically from the query."""
+    rng = random.Random(query)
+    city = rng.choice(sorted(FAKE_CITIES))
+    start = date(2025, 1, 1) + timedelta(days=rng.randrange(365))
+    days = []
+    for day_index in range(rng.randint(2, 5)):
+        day = start + timedelta(days=day_index)
+        clock = datetime(day.year, day.month, day.day, 8)
+        items = [{
+            'item_type': 'Hotel', 'description': f"从{city}酒店出发",
+            'start_time': clock.isoformat(), 'end_time': clock.isoformat(),
+            'location': {'name': f"{city}酒店", 'city': city}, 'estimated_cost': 400.0,
+        }]
+        for item_type in FAKE_ITEM_TYPES[:rng.randint(3, 5)]:
+            end = clock + timedelta(hours=rng.randint(1, 3))
+            place = rng.choice(FAKE_CITIES[city])
+            items.append({
+                'item_type': item_type, 'description': f"{place}：{query[:20]}",
+                'start_time': clock.isoformat(), 'end_time': end.isoformat(),
+                'location': {'name': place, 'city': city}, 'estimated_cost': float(rng.randrange(0, 300, 10)),
+            })
+            clock = end
+        days.append({'date': day.isoformat(), 'items': items})
+    return {'title': f"{city}{len(days)}日游", 'description': f"根据“{query}”生成的{city}行程", 'days': days}
+
+
+class FakeLLMClient:
+    """Stands in for the OpenAI client in llm_service."""
+
+    def __init__(self, latency):
+        self._latency = latency
+        self.chat = SimpleNamespace(completions=SimpleNamespace(create=self._create))
+
+    def _create(self, messages, **kwargs):
+        self._latency.sleep()
+        content = json.dumps(fake_plan(messages[-1]['content']), ensure_ascii=False)
+        return SimpleNamespace(choices=[SimpleNamespace(message=SimpleNamespace(content=content))])
+
+
+class FakeAipSpeech:
+    """Stands in for Baidu's AipSpeech client in stt_service."""
+
+    latency = FakeLatency(0)
+
+    def __init__(self, app_id, api_key, secret_key):
+        pass
+
+    def asr(self, audio_data, audio_format, rate, options):
+        self.latency.sleep()
+        return {'err_no': 0, 'result': ['我想去杭州玩三天']}
+
+
+def install_fakes(db_latency, llm_latency, asr_latency, sqlite_path=None):
+    """
+    Imports the app wired to the fakes and returns the Flask app. Must run before
+    anything else imports models, since the storage backend is picked on import.
+    """
+    os.environ['STORAGE_BACKEND'] = 'sqlite'
+    os.environ['SQLITE_PATH'] = sqlite_path or os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'travel_planner.db')
+    os.environ['GEOCODER'] = 'stub'
+    os.environ.setdefault('OPENAI_API_KEY', 'loadtest')
+    for name in ('BAIDU_APP_ID', 'BAIDU_API_KEY', 'BAIDU_SECRET_KEY'):
+        os.environ[name] = 'loadtest'
+
+    import models
+    import llm_service
+    import stt_service
+    import app as travel_app
+
+    if models.storage_backend != 'sqlite':
+        raise RuntimeError("models was imported before the load test fakes were installed")
+    models.repository = FakeSupabaseRepository(models.repository, FakeLatency(db_latency))
+    llm_service.client = FakeLLMClient(FakeLatency(llm_latency))
+    FakeAipSpeech.latency = FakeLatency(asr_latency)
+    stt_service.AipSpeech = FakeAipSpeech
+    # Sessions must survive being served by different worker processes
+    travel_app.app.secret_key = os.environ.get('LOADTEST_SECRET_KEY', 'loadtest')
+    return travel_app.app
+
+
+def create_app():
+    """WSGI factory for serving the app on the fakes, e.g. gunicorn 'loadtest:create_app()'."""
+    return install_fakes(
+        db_latency=float(os.environ.get('LOADTEST_DB_LATENCY', 0.02)),
+        llm_latency=float(os.environ.get('LOADTEST_LLM_LATENCY', 5)),
+        asr_latency=float(os.environ.get('LOADTEST_ASR_LATENCY', 0.5)),
+        # One database for all worker processes
+        sqlite_path=os.environ.get('LOADTEST_SQLITE_PATH', os.path.join(tempfile.gettempdir(), 'loadtest-travel_planner.db')),
+    )
+
+# --- Clients ---
+
+class InProcessClient:
+    """Drives the app through Flask's test client, without a server."""
+
+    def __init__(self, app):
+        self._client = app.test_client()
+
+    def request(self, method, path, data=None, json=None, files=None, headers=None):
+        if files:
+            data = dict(data or {})
+            for name, (filename, content) in files.items():
+                data[name] = (io.BytesIO(content), filename)
+        response = self._client.open(path, method=method, data=data, json=json, headers=headers)
+        return response.status_code, response.get_data(), response.headers
+
+
+class _NoRedirect(urllib_request.HTTPRedirectHandler):
+    def redirect_request(self, *args, **kwargs):
+        return None
+
+
+class HttpClient:
+    """Drives a running server over HTTP, with its own cookie jar."""
+
+    def __init__(self, base_url, timeout=120):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self._opener = urllib_request.build_opener(urllib_request.HTTPCookieProcessor(CookieJar()), _NoRedirect())
+
+    def request(self, method, path, data=None, json=None, files=None, headers=None):
+        headers = dict(headers or {})
+        body = None
+        if files:
+            body, headers['Content-Type'] = _multipart(data or {}, files)
+        elif json is not None:
+            body = _json_bytes(json)
+            headers['Content-Type'] = 'application/json'
+        elif data is not None:
+            body = parse.urlencode(data).encode()
+            headers['Content-Type'] = 'application/x-www-form-urlencoded'
+        req = urllib_request.Request(self.base_url + path, data=body, headers=headers, method=method)
+        try:
+            with self._opener.open(req, timeout=self.timeout) as response:
+                return response.status, response.read(), response.headers
+        except error.HTTPError as e:
+            return e.code, e.read(), e.headers
+
+
+def _decode_body(body, encoding):
+    if encoding == 'gzip':
+        return gzip.decompress(body)
+    if encoding == 'br':
+        return brotli.decompress(body)
+    return body
+
+
+def _json_bytes(value):
+    return json.dumps(value).encode()
+
+
+def _multipart(fields, files):
+    boundary = uuid.uuid4().hex
+    body = io.BytesIO()
+    for name, value in fields.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode())
+    for name, (filename, content) in files.items():
+        body.write(f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+                   'Content-Type: application/octet-stream\r\n\r\n'.encode())
+        body.write(content + b'\r\n')
+    body.write(f'--{boundary}--\r\n'.encode())
+    return body.getvalue(), f'multipart/form-data; boundary={boundary}'
+
+# --- Sessions ---
+
+class SessionAborted(Exception):
+    pass
+
+
+class Recorder:
+    """Collects (route, latency, status) samples from all workers."""
+
+    def __init__(self):
+        self.latencies = {}
+        self.statuses = {}
+        self.sessions = 0
+        self.aborted_sessions = 0
+        self.dropped_sessions = 0
+        self.queue_waits = []
+        self._lock = threading.Lock()
+
+    def record(self, route, seconds, status, ok):
+        with self._lock:
+            self.latencies.setdefault(route, []).append(seconds)
+            self.statuses.setdefault(route, Counter())['ok' if ok else status] += 1
+
+    def session_done(self, aborted):
+        with self._lock:
+            self.sessions += 1
+            self.aborted_sessions += aborted
+
+    def session_dequeued(self, waited, dropped):
+        with self._lock:
+            self.queue_waits.append(waited)
+            self.dropped_sessions += dropped
+
+
+class UserSession:
+    """
+    One visit of a user. Every step records its route; when a step fails the
+    steps that depend on it are skipped and the session counts as aborted.
+
+    Like a browser, a session sends Accept-Encoding and revalidates the pages it
+    has an ETag for (the user's cache persists across visits), so a 304 for a
+    cached page counts as success.
+    """
+
+    def __init__(self, client, email, registered, recorder, rng, think_time, cache=None):
+        self.client = client
+        self.email = email
+        self.registered = registered
+        self.recorder = recorder
+        self.rng = rng
+        self.think_time = think_time
+        self.cache = {} if cache is None else cache  # path -> (ETag, body)
+
+    def step(self, route, method, path, expect=(200,), headers=None, **kwargs):
+        headers = dict(BROWSER_HEADERS, **(headers or {}))
+        cached = self.cache.get(path) if method == 'GET' else None
+        if cached:
+            headers['If-None-Match'] = cached[0]
+        started = time.perf_counter()
+        status, body, response_headers = self.client.request(method, path, headers=headers, **kwargs)
+        body = _decode_body(body, response_headers.get('Content-Encoding'))
+        ok = status in expect or (status == 304 and cached is not None)
+        self.recorder.record(route, time.perf_counter() - started, status, ok)
+        if self.think_time:
+            time.sleep(self.rng.expovariate(1 / self.think_time))
+        if not ok:
+            raise SessionAborted(route)
+        if status == 304:
+            return cached[1]
+        if method == 'GET' and response_headers.get('ETag'):
+            self.cache[path] = (response_headers['ETag'], body)
+        return body
+
+    def run(self):
+        credentials = {'email': self.email, 'password': PASSWORD}
+        if not self.registered:
+            self.step('register', 'POST', '/register', data=credentials, expect=(302,))
+        self.step('login', 'POST', '/login', data=credentials, expect=(302,))
+        self.step('index', 'GET', '/')
+        if self.registered:
+            # Returning users reopen their latest plan first; a page unchanged since
+            # the last visit is revalidated with a 304
+            plan_ids = PLAN_LINK.findall(self.step('my_plans', 'GET', '/my-plans').decode())
+            if plan_ids:
+                self.step('view_plan', 'GET', f'/plan/{plan_ids[0]}')
+
+        audio = bytes(self.rng.getrandbits(8) for _ in range(32000))  # one second of 16 kHz PCM
+        self.step('transcribe', 'POST', '/transcribe', files={'audio_file': ('speech.pcm', audio)})
+        query = f"{self.rng.choice(sorted(FAKE_CITIES))}{self.rng.randint(2, 5)}日游 {self.rng.getrandbits(32)}"
+        self.step('generate', 'POST', '/generate-plan', data={'query': query})
+        self.step('save', 'POST', '/save-plan', expect=(302,))
+
+        plan_ids = PLAN_LINK.findall(self.step('my_plans', 'GET', '/my-plans').decode())
+        if not plan_ids:
+            raise SessionAborted('my_plans')
+        plan_id = plan_ids[0]
+        page = self.step('view_plan', 'GET', f'/plan/{plan_id}').decode()
+        days = json.loads(self.step('plan_days', 'GET', f'/plan/{plan_id}/days?offset=0&limit=31'))
+        item_ids = [item['id'] for day in days['days'] for item in day['items']] or ITEM_ID.findall(page)
+
+        # Inline edits: a few quick changes to one item, then a reorder of another day's items
+        item_id = self.rng.choice(item_ids)
+        for edit in range(self.rng.randint(1, 3)):
+            update = {'id': item_id, 'description': f"修改 {edit}"}
+            self.step('edit_items', 'POST', '/itinerary-items/batch-update', json={'updates': [update]})
+        reordered = [{'id': item['id'], 'order': order}
+                     for order, item in enumerate(reversed(days['days'][-1]['items']))]
+        self.step('edit_items', 'POST', '/itinerary-items/batch-update', json={'updates': reordered})
+
+        cost = json.loads(self.step('add_cost', 'POST', f'/itinerary-item/{item_id}/costs',
+                                    json={'name': '门票', 'amount': self.rng.randint(10, 200)}))
+        self.step('delete_cost', 'POST', f"/actual-cost/{cost['cost']['id']}/delete")
+        self.step('view_plan', 'GET', f'/plan/{plan_id}')
+        self.step('logout', 'GET', '/logout', expect=(302,))
+
+# --- Load levels ---
+
+class StepResult:
+    def __init__(self, level, recorder, elapsed, offered_rate=None):
+        self.level = level
+        self.recorder = recorder
+        self.elapsed = elapsed
+        self.offered_rate = offered_rate
+
+    @property
+    def requests(self):
+        return sum(len(latencies) for latencies in self.recorder.latencies.values())
+
+    @property
+    def failures(self):
+        return sum(count for statuses in self.recorder.statuses.values() for status, count in statuses.items() if status != 'ok')
+
+    @property
+    def throughput(self):
+        return self.requests / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def session_rate(self):
+        return self.recorder.sessions / self.elapsed if self.elapsed else 0.0
+
+    @property
+    def error_rate(self):
+        return self.failures / self.requests if self.requests else 0.0
+
+    def percentile(self, p, route=None):
+        if route is None:
+            latencies = [value for values in self.recorder.latencies.values() for value in values]
+        else:
+            latencies = self.recorder.latencies.get(route, [])
+        return percentile(latencies, p)
+
+    def to_dict(self):
+        return {
+            'level': self.level,
+            'elapsed': round(self.elapsed, 3),
+            'requests': self.requests,
+            'throughput': round(self.throughput, 3),
+            'sessions': self.recorder.sessions,
+            'aborted_sessions': self.recorder.aborted_sessions,
+            'arrived_sessions': len(self.recorder.queue_waits),
+            'dropped_sessions': self.recorder.dropped_sessions,
+            'queue_wait': {p: percentile(self.recorder.queue_waits, p) for p in (50, 95, 99)},
+            'session_rate': round(self.session_rate, 3),
+            'offered_rate': self.offered_rate,
+            'error_rate': round(self.error_rate, 4),
+            'latency': {p: self.percentile(p) for p in (50, 95, 99)},
+            'routes': {
+                route: {
+                    'requests': len(self.recorder.latencies[route]),
+                    'statuses': {str(status): count for status, count in self.recorder.statuses[route].items()},
+                    'latency': {p: self.percentile(p, route) for p in (50, 95, 99)},
+                    'max': max(self.recorder.latencies[route]),
+                }
+                for route in ROUTES if route in self.recorder.latencies
+            },
+        }
+
+
+def percentile(values, p):
+    """Nearest-rank percentile, or None for no values."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = max(int(-(-p * len(values) // 100)), 1)
+    return values[rank - 1]
+
+
+class UserPool:
+    """Hands out accounts round robin, so per-user rate limits see realistic reuse."""
+
+    def __init__(self, size, run_id):
+        self.emails = [f"loadtest-{run_id}-{i}@example.com" for i in range(size)]
+        self.registered = set()
+        self.caches = {email: {} for email in self.emails}  # each user's browser cache
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def checkout(self):
+        with self._lock:
+            email = self.emails[self._next % len(self.emails)]
+            self._next += 1
+            registered = email in self.registered
+            self.registered.add(email)
+            return email, registered, self.caches[email]
+
+
+def run_level(make_client, users, concurrency, duration, arrival_rate=None, think_time=0.0, seed=None):
+    """
+    Runs sessions for duration seconds. Without an arrival rate, concurrency workers
+    start a new session as soon as the previous one ends (closed loop). With one,
+    sessions arrive as a Poisson process and wait for one of the concurrency
+    workers; sessions that are still waiting when the time is up are dropped
+    (open loop).
+    """
+    recorder = Recorder()
+    deadline = time.monotonic() + duration
+    arrivals = queue.Queue()
+    rng = random.Random(seed)
+
+    def run_session(worker_rng):
+        email, registered, cache = users.checkout()
+        try:
+            UserSession(make_client(), email, registered, recorder, worker_rng, think_time, cache).run()
+            recorder.session_done(aborted=False)
+        except SessionAborted:
+            recorder.session_done(aborted=True)
+
+    def worker(worker_seed):
+        worker_rng = random.Random(worker_seed)
+        while True:
+            if arrival_rate is None:
+                if time.monotonic() >= deadline:
+                    return
+            else:
+                arrived_at = arrivals.get()
+                if arrived_at is None:
+                    return
+                now = time.monotonic()
+                recorder.session_dequeued(now - arrived_at, dropped=now >= deadline)
+                if now >= deadline:
+                    continue
+            run_session(worker_rng)
+
+    started = time.monotonic()
+    workers = [threading.Thread(target=worker, args=(rng.random(),), daemon=True) for _ in range(concurrency)]
+    for thread in workers:
+        thread.start()
+    if arrival_rate is not None:
+        next_arrival = started
+        while True:
+            next_arrival += rng.expovariate(arrival_rate)
+            if next_arrival >= deadline:
+                break
+            time.sleep(max(next_arrival - time.monotonic(), 0))
+            arrivals.put(time.monotonic())
+        for _ in workers:
+            arrivals.put(None)
+    for thread in workers:
+        thread.join()
+    return StepResult(arrival_rate if arrival_rate is not None else concurrency, recorder,
+                      time.monotonic() - started, offered_rate=arrival_rate)
+
+
+def find_saturation(steps, min_gain=0.1, max_error_rate=0.01):
+    """
+    Returns (index, reason) of the first level that is saturated, or (None, None).
+    A closed-loop level is saturated when its throughput grows less than min_gain
+    over the previous level; an open-loop level when more than 10% of the arriving
+    sessions never got a worker. Either is saturated once errors exceed
+    max_error_rate.
+    """
+    for index, step in enumerate(steps):
+        if step.error_rate > max_error_rate:
+            return index, f"error rate {step.error_rate:.1%}"
+        if step.offered_rate is not None:
+            arrived, dropped = len(step.recorder.queue_waits), step.recorder.dropped_sessions
+            if dropped > 0.1 * arrived:
+                return index, f"dropped {dropped} of {arrived} arriving sessions"
+        elif index and step.throughput < steps[index - 1].throughput * (1 + min_gain):
+            gain = step.throughput / steps[index - 1].throughput - 1 if steps[index - 1].throughput else 0.0
+            return index, f"throughput {gain:+.0%} over the previous level"
+    return None, None
+
+# --- Reporting ---
+
+def _ms(seconds):
+    return '-' if seconds is None else f"{seconds * 1000:.0f}"
+
+
+def print_report(steps, level_name):
+    print(f"{level_name:>12} {'req/s':>8} {'sess/s':>7} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'errors':>7} {'aborted':>8}")
+    for step in steps:
+        print(f"{step.level:>12g} {step.throughput:>8.2f} {step.session_rate:>7.2f} {_ms(step.percentile(50)):>8} "
+              f"{_ms(step.percentile(95)):>8} {_ms(step.percentile(99)):>8} {step.error_rate:>7.1%} "
+              f"{step.recorder.aborted_sessions:>8}")
+
+    for step in steps:
+        print(f"\n{level_name} {step.level:g}:")
+        if step.offered_rate is not None:
+            print(f"  {len(step.recorder.queue_waits)} sessions arrived, {step.recorder.dropped_sessions} dropped, "
+                  f"p95 wait for a worker {_ms(percentile(step.recorder.queue_waits, 95))} ms")
+        print(f"  {'route':<12} {'count':>6} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8} {'max ms':>8}  failures")
+        for route in ROUTES:
+            latencies = step.recorder.latencies.get(route)
+            if not latencies:
+                continue
+            failures = ', '.join(f"{status}: {count}" for status, count in step.recorder.statuses[route].items() if status != 'ok')
+            print(f"  {route:<12} {len(latencies):>6} {_ms(step.percentile(50, route)):>8} {_ms(step.percentile(95, route)):>8} "
+                  f"{_ms(step.percentile(99, route)):>8} {_ms(max(latencies)):>8}  {failures}")
+
+    index, reason = find_saturation(steps)
+    peak = max(steps, key=lambda step: step.throughput)
+    print(f"\nPeak throughput: {peak.throughput:.2f} req/s at {level_name} {peak.level:g}")
+    if index is None:
+        print(f"Saturation: not reached up to {level_name} {steps[-1].level:g}")
+    else:
+        print(f"Saturation: at {level_name} {steps[index].level:g} ({reason})")
+    return index, reason, peak
+
+# --- CLI ---
+
+def _levels(value):
+    if not value:
+        return []
+    try:
+        return [float(level) for level in value.split(',')]
+    except ValueError:
+        raise click.BadParameter("expected a comma-separated list of numbers")
+
+
+@click.group()
+def cli():
+    pass
+
+
+@cli.command()
+@click.option('--concurrency', default='1,2,4,8,16', help="Comma-separated concurrent sessions per level (closed loop), "
+                                                      "or the worker limit with --arrival-rate.")
+@click.option('--arrival-rate', default='', help="Comma-separated session arrival rates per second (open loop).")
+@click.option('--step-duration', default=30.0, show_default=True, help="Seconds per load level.")
+@click.option('--users', default=1000, show_default=True, help="Accounts the sessions rotate through.")
+@click.option('--think-time', default=0.0, show_default=True, help="Mean pause in seconds between a user's requests.")
+@click.option('--target', default=None, help="Base URL of a running server; by default the app runs in-process.")
+@click.option('--db-latency', default=0.02, show_default=True, help="Seconds per storage round trip (in-process only).")
+@click.option('--llm-latency', default=5.0, show_default=True, help="Seconds per plan generation (in-process only).")
+@click.option('--asr-latency', default=0.5, show_default=True, help="Seconds per transcription (in-process only).")
+@click.option('--seed', default=None, type=int, help="Seed for reproducible sessions.")
+@click.option('--output', type=click.Path(dir_okay=False), default=None, help="Write the results as JSON.")
+@click.option('--baseline', type=click.Path(exists=True, dir_okay=False), default=None,
+              help="Results JSON of an earlier run to compare peak throughput with.")
+@click.option('--max-regression', default=0.1, show_default=True, help="Allowed drop in peak throughput against the baseline.")
+def run(concurrency, arrival_rate, step_duration, users, think_time, target, db_latency, llm_latency, asr_latency,
+        seed, output, baseline, max_regression):
+    """Runs the load levels and reports throughput, latencies and saturation."""
+    concurrency_levels = [int(level) for level in _levels(concurrency)]
+    arrival_rates = _levels(arrival_rate)
+    if not concurrency_levels:
+        raise click.BadParameter("at least one level is required", param_hint='--concurrency')
+
+    if target:
+        make_client = lambda: HttpClient(target)
+    else:
+        app = install_fakes(db_latency, llm_latency, asr_latency)
+        make_client = lambda: InProcessClient(app)
+
+    user_pool = UserPool(users, uuid.uuid4().hex[:8])
+    steps = []
+    if arrival_rates:
+        level_name = 'sessions/s'
+        for rate in arrival_rates:
+            click.echo(f"Running {rate:g} sessions/s (at most {concurrency_levels[-1]} at a time) for {step_duration:g}s...", err=True)
+            steps.append(run_level(make_client, user_pool, concurrency_levels[-1], step_duration, arrival_rate=rate,
+                                   think_time=think_time, seed=seed))
+    else:
+        level_name = 'concurrency'
+        for level in concurrency_levels:
+            click.echo(f"Running {level} concurrent sessions for {step_duration:g}s...", err=True)
+            steps.append(run_level(make_client, user_pool, level, step_duration, think_time=think_time, seed=seed))
+
+    saturation_index, saturation_reason, peak = print_report(steps, level_name)
+
+    results = {
+        'target': target or 'in-process',
+        'mode': level_name,
+        'config': {'step_duration': step_duration, 'users': users, 'think_time': think_time, 'db_latency': db_latency,
+                   'llm_latency': llm_latency, 'asr_latency': asr_latency},
+        'steps': [step.to_dict() for step in steps],
+        'peak_throughput': round(peak.throughput, 3),
+        'saturation': None if saturation_index is None else {'level': steps[saturation_index].level, 'reason': saturation_reason},
+    }
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2)
+
+    if baseline:
+        with open(baseline, encoding='utf-8') as f:
+            baseline_throughput = json.load(f)['peak_throughput']
+        change = peak.throughput / baseline_throughput - 1 if baseline_throughput else 0.0
+        print(f"Peak throughput vs baseline: {change:+.1%} ({baseline_throughput:.2f} req/s before)")
+        if change < -max_regression:
+            raise click.ClickException(f"Throughput regressed by more than {max_regression:.0%}")
+
+
+@cli.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=5000, show_default=True)
+@click.option('--db-latency', default=0.02, show_default=True)
+@click.option('--llm-latency', default=5.0, show_default=True)
+@click.option('--asr-latency', default=0.5, show_default=True)
+def serve(host, port, db_latency, llm_latency, asr_latency):
+    """Serves the app on the fakes with the threaded development server."""
+    app = install_fakes(db_latency, llm_latency, asr_latency, sqlite_path=os.environ.get('LOADTEST_SQLITE_PATH'))
+    app.run(host=host, port=port, threaded=True)
+
+
+if __name__ == '__main__':
+    cli()
@@ -2,14 +2,18 @@ import os
 import uuid
 from datetime import datetime, timezone
 from dotenv import load_dotenv
-from supabase import create_client, Client
+
+import storage
 
 load_dotenv()
 
-# --- Supabase Setup ---
-supabase_url = os.environ.get("SUPABASE_URL")
-supabase_key = os.environ.get("SUPABASE_ANON_KEY")
-supabase: Client = create_client(supabase_url, supabase_key)
+# --- Storage Setup ---
+# STORAGE_BACKEND picks where plans live: "supabase" (default) or "sqlite"
+# (a local file at SQLITE_PATH, handy for development and load tests).
+storage_backend = os.environ.get("STORAGE_BACKEND", "supabase")
+supabase_url = os.environ.get("SUPABASE_URL") if storage_backend == "supabase" else None
+supabase_key = os.environ.get("SUPABASE_ANON_KEY") if storage_backend == "supabase" else None
+repository = storage.create_repository(storage_backend)
 
 # --- Data Models ---
 
@@ -22,12 +26,14 @@ class User:
         return {"id": self.id, "email": self.email}
 
 class TravelPlan:
-    def __init__(self, user_id, title, description="", days=None, id=None, created_at=None):
+    def __init__(self, user_id, title, description="", days=None, id=None, created_at=None, updated_at=None):
         self.id = id if id else str(uuid.uuid4())
         self.user_id = user_id
         self.title = title
         self.description = description
         self.created_at = created_at if created_at else datetime.now(timezone.utc).replace(microsecond=0)
+        # updated_at doubles as the plan's version: every mutation bumps it
+        self.updated_at = updated_at if updated_at else self.created_at
         self.days = days if days else []
 
     def to_dict(self):
@@ -37,6 +43,7 @@ class TravelPlan:
             "title": self.title,
             "description": self.description,
             "created_at": self.created_at.isoformat(),
+            "updated_at": self.updated_at.isoformat(),
             "days": [day.to_dict() for day in self.days],
         }
 
@@ -108,114 +115,222 @@ class ActualCost:
             "amount": self.amount,
         }
 
+# --- Plan Versioning ---
+# Every mutation below bumps plans.updated_at so that views can cheaply check
+# whether anything changed (see get_plan_summary / get_plan_summaries_by_user).
+
+_plan_change_listeners = []
+
+def add_plan_change_listener(listener):
+    """Registers listener(plan_id), called after a plan or anything in it was changed or deleted."""
+    _plan_change_listeners.append(listener)
+
+def _notify_plan_changed(plan_id):
+    for listener in _plan_change_listeners:
+        listener(plan_id)
+
+def _now():
+    return datetime.now(timezone.utc)
+
+def _parse_timestamp(value):
+    # Postgres trims trailing zeros from fractional seconds (".12345+00:00"),
+    # which datetime.fromisoformat() rejects before Python 3.11.
+    if '.' in value:
+        head, _, tail = value.partition('.')
+        digits = len(tail) - len(tail.lstrip('0123456789'))
+        value = head + '.' + tail[:digits].ljust(6, '0')[:6] + tail[digits:]
+    return datetime.fromisoformat(value)
+
+def _touch_plan(plan_id):
+    if plan_id:
+        _touch_plans([plan_id])
+
+def _touch_plans(plan_ids):
+    plan_ids = list(plan_ids)
+    if not plan_ids:
+        return
+    repository.touch_plans(plan_ids, _now().isoformat())
+    for plan_id in plan_ids:
+        _notify_plan_changed(plan_id)
+
+# --- Auth ---
+
+def sign_in_with_password(email, password):
+    """Returns the User for valid credentials, raises otherwise."""
+    user_id, user_email = repository.sign_in(email, password)
+    return User(id=user_id, email=user_email)
+
+def sign_up(email, password):
+    user_id, user_email = repository.sign_up(email, password)
+    return User(id=user_id, email=user_email)
+
 # --- Database CRUD ---
 
 def create_plan(plan):
-    # 1. Insert the plan
-    plan_data = supabase.table('plans').insert({
-        'id': plan.id,
-        'user_id': plan.user_id,
-        'title': plan.title,
-        'description': plan.description
-    }).execute()
-
-    if not plan_data.data:
-        raise Exception("Failed to create plan")
-
-    # 2. Insert the days, locations, items and costs
-    inserted_location_ids = set()
-    for day in plan.days:
-        day.plan_id = plan.id
-        day_data = supabase.table('days').insert({
-            'id': day.id,
-            'plan_id': day.plan_id,
-            'date': day.date.isoformat()
-        }).execute()
-
-        if not day_data.data:
-            raise Exception("Failed to create day")
-
-        for i, item in enumerate(day.items):
-            item.day_id = day.id
-            
-            # Always set the location_id on the item if a location exists
-            if item.location:
-                item.location_id = item.location.id
-
-                # But only insert the location into the DB if it's the first time we've seen it
-                if item.location.id not in inserted_location_ids:
-                    supabase.table('locations').insert({
-                        'id': item.location.id,
-                        'name': item.location.name,
-                        'city': item.location.city
-                    }).execute()
-                    inserted_location_ids.add(item.location.id)
-
-            item_insert = {
-                'id': item.id,
-                'day_id': item.day_id,
-                'item_type': item.item_type,
-                'description': item.description,
-                'start_time': item.start_time.isoformat() if item.start_time else None,
-                'end_time': item.end_time.isoformat() if item.end_time else None,
-                'location_id': item.location_id,
-                'estimated_cost': item.estimated_cost,
-                'order': i
-            }
-            
-            item_data = supabase.table('itinerary_items').insert(item_insert).execute()
-
-            if not item_data.data:
-                raise Exception("Failed to create itinerary item")
-
-            for cost in item.actual_costs:
-                cost.itinerary_item_id = item.id
-                supabase.table('actual_costs').insert({
-                    'id': cost.id,
-                    'itinerary_item_id': cost.itinerary_item_id,
-                    'name': cost.name,
-                    'amount': cost.amount
-                }).execute()
-
-    return plan
-
-def update_itinerary_item(item_id, updates):
-    allowed_updates = {}
-    for key in ['item_type', 'description', 'start_time', 'end_time', 'estimated_cost', 'location', 'city', 'order']:
-        if key in updates:
-            allowed_updates[key] = updates[key]
+    return bulk_create_plans([plan])[0]
+
+def bulk_create_plans(plans, chunk_size=500):
+    """
+    Inserts plans with all their days, items and actual costs using a few chunked
+    inserts per table instead of one request per row. Locations are resolved in
+    bulk, reusing existing (name, city) rows.
+    """
+    location_ids = resolve_locations({
+        (item.location.name, item.location.city)
+        for plan in plans for day in plan.days for item in day.items if item.location
+    })
+
+    now = _now()
+    plan_rows, day_rows, item_rows, cost_rows = [], [], [], []
+    for plan in plans:
+        plan.updated_at = now
+        plan_rows.append({
+            'id': plan.id,
+            'user_id': plan.user_id,
+            'title': plan.title,
+            'description': plan.description,
+            'created_at': plan.created_at.isoformat(),
+            'updated_at': now.isoformat()
+        })
+        for day in plan.days:
+            day.plan_id = plan.id
+            day_rows.append({'id': day.id, 'plan_id': day.plan_id, 'date': day.date.isoformat()})
+            for i, item in enumerate(day.items):
+                item.day_id = day.id
+                item.order = i
+                if item.location:
+                    item.location.id = item.location_id = location_ids[(item.location.name, item.location.city)]
+                item_rows.append({
+                    'id': item.id,
+                    'day_id': item.day_id,
+                    'item_type': item.item_type,
+                    'description': item.description,
+                    'start_time': item.start_time.isoformat() if item.start_time else None,
+                    'end_time': item.end_time.isoformat() if item.end_time else None,
+                    'location_id': item.location_id,
+                    'estimated_cost': item.estimated_cost,
+                    'order': item.order
+                })
+                for cost in item.actual_costs:
+                    cost.itinerary_item_id = item.id
+                    cost_rows.append(cost.to_dict())
+
+    repository.insert_plan_trees(plan_rows, day_rows, item_rows, cost_rows, chunk_size)
+
+    for plan in plans:
+        _notify_plan_changed(plan.id)
+    return plans
+
+def resolve_locations(pairs):
+    """Maps each (name, city) pair to a location id, creating the missing locations in bulk."""
+    pairs = set(pairs)
+    if not pairs:
+        return {}
+    return repository.resolve_locations(pairs)
+
+ITEM_UPDATE_FIELDS = ['item_type', 'description', 'start_time', 'end_time', 'estimated_cost', 'location', 'city', 'order']
+
+def clean_item_update(updates):
+    """
+    Picks the updatable fields of an itinerary item and normalizes their values:
+    times to ISO 8601 strings (or None), estimated_cost to a float and order to an
+    int. Raises ValueError for a value that can't be stored.
+    """
+    cleaned = {}
+    for key in ITEM_UPDATE_FIELDS:
+        if key not in updates:
+            continue
+        value = updates[key]
+        if key in ('start_time', 'end_time'):
+            if value:
+                try:
+                    value = datetime.fromisoformat(str(value)).isoformat()
+                except ValueError:
+                    raise ValueError(f"invalid {key}: {value!r}")
+            else:
+                value = None
+        elif key == 'estimated_cost':
+            try:
+                value = float(value) if value not in (None, '') else 0.0
+            except (TypeError, ValueError):
+                raise ValueError(f"invalid estimated_cost: {value!r}")
+            if value < 0 or value != value:
+                raise ValueError(f"invalid estimated_cost: {value!r}")
+        elif key == 'order':
+            if isinstance(value, bool) or not isinstance(value, (int, str)) or not str(value).strip().isdigit():
+                raise ValueError(f"invalid order: {value!r}")
+            value = int(value)
+        elif value is not None and not isinstance(value, str):
+            raise ValueError(f"invalid {key}: {value!r}")
+        cleaned[key] = value
+    return cleaned
+
+def _item_update_fields(updates):
+    """
+    Maps cleaned updates (see clean_item_update) to item columns. Returns (fields,
+    location_key), where location_key is the (name, city) to resolve into
+    fields['location_id'].
+    """
+    allowed_updates = dict(updates)
 
     # Handle location
+    location_key = None
     if 'location' in allowed_updates:
         location_name = allowed_updates.pop('location')
         city_name = allowed_updates.pop('city', 'Unknown') # Get city, default to Unknown
         if location_name:
-            # Check if location exists
-            location_data = supabase.table('locations').select('id').eq('name', location_name).eq('city', city_name).execute()
-            if location_data.data:
-                allowed_updates['location_id'] = location_data.data[0]['id']
-            else:
-                # Create new location
-                new_location_id = str(uuid.uuid4())
-                supabase.table('locations').insert({'id': new_location_id, 'name': location_name, 'city': city_name}).execute()
-                allowed_updates['location_id'] = new_location_id
+            location_key = (location_name, city_name)
         else:
             allowed_updates['location_id'] = None
+    # A city on its own is not a column
+    allowed_updates.pop('city', None)
 
+    return allowed_updates, location_key
 
-    # Convert datetime objects to ISO 8601 strings if they exist
-    if 'start_time' in allowed_updates and allowed_updates['start_time']:
-        allowed_updates['start_time'] = datetime.fromisoformat(allowed_updates['start_time']).isoformat()
-    if 'end_time' in allowed_updates and allowed_updates['end_time']:
-        allowed_updates['end_time'] = datetime.fromisoformat(allowed_updates['end_time']).isoformat()
+def update_itinerary_item(item_id, updates):
+    allowed_updates, location_key = _item_update_fields(clean_item_update(updates))
+    if location_key:
+        allowed_updates['location_id'] = resolve_locations([location_key])[location_key]
 
-    response = supabase.table('itinerary_items').update(allowed_updates).eq('id', item_id).execute()
-    if not response.data:
+    row = repository.update_itinerary_item(item_id, allowed_updates)
+    if not row:
         raise Exception(f"Failed to update itinerary item with id {item_id}")
-    return response.data[0]
+    _touch_plans(repository.plan_ids_for_days([row['day_id']]))
+    return row
+
+def bulk_update_itinerary_items(updates):
+    """
+    Applies {item_id: fields} (as returned by clean_item_update) to many items with
+    one location lookup. Only the given columns are written, so concurrent changes
+    to other columns of the same items are kept. Returns {item_id: updated row};
+    ids that do not exist are left out.
+    """
+    if not updates:
+        return {}
+    columns = {}
+    location_keys = {}
+    for item_id, fields in updates.items():
+        columns[item_id], location_keys[item_id] = _item_update_fields(fields)
+    location_ids = resolve_locations({location_key for location_key in location_keys.values() if location_key})
+    for item_id, location_key in location_keys.items():
+        if location_key:
+            columns[item_id]['location_id'] = location_ids[location_key]
+
+    updated = repository.update_itinerary_items(columns)
+    if updated:
+        _touch_plans(repository.plan_ids_for_days({row['day_id'] for row in updated}))
+    return {row['id']: row for row in updated}
+
+def user_ids_for_items(item_ids):
+    """Returns {item_id: id of the user owning the item's plan}; unknown ids are left out."""
+    if not item_ids:
+        return {}
+    return repository.user_ids_for_items(list(item_ids))
 
 def delete_itinerary_item(item_id):
-    supabase.table('itinerary_items').delete().eq('id', item_id).execute()
+    plan_id = repository.plan_id_for_item(item_id)
+    repository.delete_itinerary_item(item_id)
+    _touch_plan(plan_id)
 
 def insert_itinerary_item(day_id, item_data):
     # This function now assumes that the correct order is provided in item_data.
@@ -236,15 +351,8 @@ def insert_itinerary_item(day_id, item_data):
     location_name = item_data.get('location')
     city_name = item_data.get('city', 'Unknown')
     if location_name:
-        # Check if location exists
-        location_data = supabase.table('locations').select('id').eq('name', location_name).eq('city', city_name).execute()
-        if location_data.data:
-            new_item_payload['location_id'] = location_data.data[0]['id']
-        else:
-            # Create new location
-            new_location_id = str(uuid.uuid4())
-            supabase.table('locations').insert({'id': new_location_id, 'name': location_name, 'city': city_name}).execute()
-            new_item_payload['location_id'] = new_location_id
+        location_key = (location_name, city_name)
+        new_item_payload['location_id'] = resolve_locations([location_key])[location_key]
 
     # Convert datetime objects to ISO 8601 strings if they exist
     if new_item_payload['start_time']:
@@ -252,119 +360,151 @@ def insert_itinerary_item(day_id, item_data):
     if new_item_payload['end_time']:
         new_item_payload['end_time'] = datetime.fromisoformat(new_item_payload['end_time']).isoformat()
 
-    new_item = supabase.table('itinerary_items').insert(new_item_payload).execute()
+    new_item = repository.insert_itinerary_item(new_item_payload)
 
-    if not new_item.data:
+    if not new_item:
         raise Exception("Failed to insert new itinerary item")
 
-    return new_item.data[0]
+    _touch_plans(repository.plan_ids_for_days([day_id]))
+    return new_item
 
 def get_plan(plan_id):
-    plan_data = supabase.table('plans').select("*, days(*, itinerary_items(*, locations(*), actual_costs(*)))").eq('id', plan_id).single().execute()
-    if not plan_data.data:
+    plan_data = repository.get_plan(plan_id)
+    if not plan_data:
         return None
 
-    return _dict_to_travel_plan(plan_data.data)
+    return _dict_to_travel_plan(plan_data)
 
 def get_plans_by_user(user_id):
-    plans_data = supabase.table('plans').select("*, days(*, itinerary_items(*, locations(*), actual_costs(*)))").eq('user_id', user_id).execute()
-    return [_dict_to_travel_plan(plan) for plan in plans_data.data]
+    return [_dict_to_travel_plan(plan) for plan in repository.get_plans_by_user(user_id)]
+
+def get_plans(plan_ids):
+    """Returns the full plans with the given ids, in no particular order."""
+    if not plan_ids:
+        return []
+    return [_dict_to_travel_plan(plan) for plan in repository.get_plans(list(plan_ids))]
+
+def get_plans_page(user_id=None, after=None, limit=50):
+    """
+    Returns up to limit full plans ordered by id, starting after the plan id `after`.
+    Keyset pagination keeps every page equally cheap, however deep the export goes.
+    """
+    return [_dict_to_travel_plan(plan) for plan in repository.get_plans_page(user_id, after, limit)]
+
+def get_plan_summary(plan_id):
+    """Returns the plan row without its days, or None. Cheap enough to run before every view."""
+    plan_data = repository.get_plan_summary(plan_id)
+    if not plan_data:
+        return None
+    return _dict_to_travel_plan(plan_data)
 
-def delete_plan(plan_id):
-    # 1. Get the plan to retrieve location_ids
-    plan = get_plan(plan_id)
-    if not plan:
-        return False
-    location_ids = [item.location.id for day in plan.days for item in day.items if item.location]
+def get_plan_summaries_by_user(user_id):
+    """Returns the user's plans without their days, newest first."""
+    return [_dict_to_travel_plan(plan) for plan in repository.get_plan_summaries_by_user(user_id)]
 
-    # 2. Delete the plan, which will cascade to days, itinerary_items, and actual_costs
-    supabase.table('plans').delete().eq('id', plan_id).execute()
+def get_days(plan_id, offset=0, limit=None):
+    """
+    Returns a slice of the plan's days (with items and costs) ordered by date,
+    together with the plan's total number of days.
+    """
+    days_data, total = repository.get_days(plan_id, offset, limit)
+    return [_dict_to_day(day) for day in days_data], total
 
-    # 3. Delete the now-orphaned locations
-    if location_ids:
-        supabase.table('locations').delete().in_('id', location_ids).execute()
+def get_plan_cost_totals(plan_id):
+    """Returns the plan's (estimated, actual) cost totals without loading the full tree."""
+    return repository.get_plan_cost_totals(plan_id)
 
+def delete_plan(plan_id):
+    # Cascades to days, itinerary_items and actual_costs, and removes the
+    # plan's locations that no other plan refers to
+    if not repository.delete_plan(plan_id):
+        return False
+    _notify_plan_changed(plan_id)
     return True
 
 def create_actual_cost(cost):
-    data = supabase.table('actual_costs').insert(cost.to_dict()).execute()
-    if not data.data:
+    data = repository.create_actual_cost(cost.to_dict())
+    if not data:
         raise Exception("Failed to create actual cost")
+    _touch_plan(repository.plan_id_for_item(cost.itinerary_item_id))
     return ActualCost(
-        id=data.data[0]['id'],
-        itinerary_item_id=data.data[0]['itinerary_item_id'],
-        name=data.data[0]['name'],
-        amount=data.data[0]['amount']
+        id=data['id'],
+        itinerary_item_id=data['itinerary_item_id'],
+        name=data['name'],
+        amount=data['amount']
     )
 
 def get_actual_cost(cost_id):
-    data = supabase.table('actual_costs').select("*").eq('id', cost_id).single().execute()
-    if not data.data:
-        return None
-    return data.data
+    return repository.get_actual_cost(cost_id)
 
 def delete_actual_cost(cost_id):
-    supabase.table('actual_costs').delete().eq('id', cost_id).execute()
+    plan_id = repository.plan_id_for_cost(cost_id)
+    repository.delete_actual_cost(cost_id)
+    _touch_plan(plan_id)
     return True
 
 def _dict_to_travel_plan(plan_dict):
-    days = []
-    for day_dict in plan_dict.get('days', []):
-        items = []
-        for item_dict in day_dict.get('itinerary_items', []):
-            location = None
-            if item_dict.get('locations'):
-                loc_dict = item_dict['locations']
-                location = Location(
-                    id=loc_dict['id'],
-                    name=loc_dict['name'],
-                    city=loc_dict['city']
-                )
-            
-            actual_costs = []
-            for cost_dict in item_dict.get('actual_costs', []):
-                actual_costs.append(ActualCost(
-                    id=cost_dict['id'],
-                    itinerary_item_id=cost_dict['itinerary_item_id'],
-                    name=cost_dict['name'],
-                    amount=cost_dict['amount']
-                ))
-
-            items.append(ItineraryItem(
-                id=item_dict['id'],
-                day_id=item_dict['day_id'],
-                item_type=item_dict['item_type'],
-                description=item_dict['description'],
-                start_time=datetime.fromisoformat(item_dict['start_time']) if item_dict.get('start_time') else None,
-                end_time=datetime.fromisoformat(item_dict['end_time']) if item_dict.get('end_time') else None,
-                location=location,
-                location_id=item_dict.get('location_id'),
-                estimated_cost=item_dict.get('estimated_cost', 0.0),
-                actual_costs=actual_costs,
-                order=item_dict.get('order', 0)
-            ))
-        
-        # Sort items by order
-        items.sort(key=lambda item: item.order)
-
-        days.append(Day(
-            id=day_dict['id'],
-            plan_id=day_dict['plan_id'],
-            date=datetime.fromisoformat(day_dict['date']).date(),
-            items=items
-        ))
-    
+    days = [_dict_to_day(day_dict) for day_dict in plan_dict.get('days', [])]
+    days.sort(key=lambda day: day.date)
+
     return TravelPlan(
         id=plan_dict['id'],
         user_id=plan_dict['user_id'],
         title=plan_dict['title'],
         description=plan_dict['description'],
-        created_at=datetime.fromisoformat(plan_dict['created_at']),
+        created_at=_parse_timestamp(plan_dict['created_at']),
+        updated_at=_parse_timestamp(plan_dict['updated_at']) if plan_dict.get('updated_at') else None,
         days=days
     )
 
+def _dict_to_day(day_dict):
+    items = []
+    for item_dict in day_dict.get('itinerary_items', []):
+        location = None
+        if item_dict.get('locations'):
+            loc_dict = item_dict['locations']
+            location = Location(
+                id=loc_dict['id'],
+                name=loc_dict['name'],
+                city=loc_dict['city']
+            )
+
+        actual_costs = []
+        for cost_dict in item_dict.get('actual_costs', []):
+            actual_costs.append(ActualCost(
+                id=cost_dict['id'],
+                itinerary_item_id=cost_dict['itinerary_item_id'],
+                name=cost_dict['name'],
+                amount=cost_dict['amount']
+            ))
+
+        items.append(ItineraryItem(
+            id=item_dict['id'],
+            day_id=item_dict['day_id'],
+            item_type=item_dict['item_type'],
+            description=item_dict['description'],
+            start_time=datetime.fromisoformat(item_dict['start_time']) if item_dict.get('start_time') else None,
+            end_time=datetime.fromisoformat(item_dict['end_time']) if item_dict.get('end_time') else None,
+            location=location,
+            location_id=item_dict.get('location_id'),
+            estimated_cost=item_dict.get('estimated_cost', 0.0),
+            actual_costs=actual_costs,
+            order=item_dict.get('order', 0)
+        ))
+
+    # Sort items by order
+    items.sort(key=lambda item: item.order)
+
+    return Day(
+        id=day_dict['id'],
+        plan_id=day_dict['plan_id'],
+        date=datetime.fromisoformat(day_dict['date']).date(),
+        items=items
+    )
+
 # --- Database Schema Note ---
-# You need to create the following tables in your Supabase project:
+# With the Supabase backend, you need to create the following tables in your
+# Supabase project. The SQLite backend creates them itself (storage/sqlite_backend.py).
 #
 # 1. plans:
 #    - id: uuid (Primary Key)
@@ -372,6 +512,7 @@ def _dict_to_travel_plan(plan_dict):
 #    - title: text
 #    - description: text
 #    - created_at: timestampz (default: now())
+#    - updated_at: timestampz (default: now()) -- bumped on every change to the plan or its children
 #
 # 2. days:
 #    - id: uuid (Primary Key)
@@ -400,5 +541,28 @@ def _dict_to_travel_plan(plan_dict):
 #    - name: text
 #    - amount: float8
 #
+# Index plans(user_id), days(plan_id), itinerary_items(day_id),
+# itinerary_items(location_id), actual_costs(itinerary_item_id) and
+# locations(name, city): every read and the orphan check in delete_plan go
+# through them.
+#
+# Bulk item updates (edits, reorders, route optimization) call this function, which
+# writes only the columns present in each element, for all items in one statement:
+#
+#   create or replace function update_itinerary_items(updates jsonb)
+#   returns setof itinerary_items language sql security invoker as $$
+#     update itinerary_items i set
+#       location_id = case when u.value ? 'location_id' then (u.value->>'location_id')::uuid else i.location_id end,
+#       item_type = case when u.value ? 'item_type' then u.value->>'item_type' else i.item_type end,
+#       description = case when u.value ? 'description' then u.value->>'description' else i.description end,
+#       start_time = case when u.value ? 'start_time' then (u.value->>'start_time')::timestamptz else i.start_time end,
+#       end_time = case when u.value ? 'end_time' then (u.value->>'end_time')::timestamptz else i.end_time end,
+#       estimated_cost = case when u.value ? 'estimated_cost' then (u.value->>'estimated_cost')::float8 else i.estimated_cost end,
+#       "order" = case when u.value ? 'order' then (u.value->>'order')::int4 else i."order" end
+#     from jsonb_array_elements(updates) as u
+#     where i.id = (u.value->>'id')::uuid
+#     returning i.*;
+#   $$;
+#
 # Make sure to enable Row Level Security (RLS) on these tables and create policies
 # that allow users to access only their own data.
@@ -0,0 +1,420 @@
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from urllib import parse, request as urllib_request
+
+import numpy as np
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Items that stay where they are when a day is reordered: the hotel anchors the
+# start and end of the day, and transport and meals happen at a set time.
+FIXED_ITEM_TYPES = ('Hotel', 'Transportation', 'Meal')
+
+# Segments up to this size are solved exactly, longer ones heuristically
+EXACT_SEGMENT_SIZE = 8
+
+
+# --- Geocoding ---
+
+class AMapGeocoder:
+    """
+    Geocodes through the AMap web service API, up to 10 addresses of one city per
+    request, with up to max_concurrency requests in flight. Needs a "Web服务" key;
+    the JS API key the map uses is rejected. Coordinates are AMap's (GCJ-02),
+    which is what the map in _plan_view.html uses.
+    """
+
+    URL = 'https://restapi.amap.com/v3/geocode/geo'
+    BATCH_SIZE = 10
+
+    def __init__(self, key, timeout=5, max_concurrency=5):
+        if not key:
+            raise ValueError("AMap geocoding needs a web service key (AMAP_WEB_SERVICE_KEY)")
+        self.key = key
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=max_concurrency, thread_name_prefix='amap-geocode')
+
+    def geocode(self, pairs):
+        """Returns {(name, city): (lat, lon)} for the pairs AMap could locate."""
+        by_city = {}
+        for name, city in pairs:
+            by_city.setdefault(city, []).append(name)
+        batches = [(city, names[start:start + self.BATCH_SIZE])
+                   for city, names in by_city.items() for start in range(0, len(names), self.BATCH_SIZE)]
+
+        coordinates = {}
+        for batch_coordinates in self._executor.map(lambda batch: self._geocode_batch(*batch), batches):
+            coordinates.update(batch_coordinates)
+        return coordinates
+
+    def _geocode_batch(self, city, names):
+        query = parse.urlencode({'key': self.key, 'address': '|'.join(names), 'city': city or '',
+                                 'batch': 'true', 'output': 'JSON'})
+        with urllib_request.urlopen(f"{self.URL}?{query}", timeout=self.timeout) as response:
+            result = json.loads(response.read().decode('utf-8'))
+        if result.get('status') != '1':
+            raise Exception(f"AMap geocoding failed: {result.get('info', 'Unknown error')}")
+        # Batch results are positional; unknown addresses come back without a location
+        coordinates = {}
+        for name, geocode in zip(names, result.get('geocodes', [])):
+            if geocode and geocode.get('location'):
+                lon, lat = (float(value) for value in geocode['location'].split(','))
+                coordinates[(name, city)] = (lat, lon)
+        return coordinates
+
+
+class StubGeocoder:
+    """
+    Offline geocoder for development and load tests: places each location at a
+    stable pseudo-random point within about 15 km of its city's center.
+    """
+
+    CITY_CENTERS = {
+        '北京': (39.9042, 116.4074),
+        '上海': (31.2304, 121.4737),
+        '广州': (23.1291, 113.2644),
+        '深圳': (22.5431, 114.0579),
+        '杭州': (30.2741, 120.1551),
+        '南京': (32.0603, 118.7969),
+        '苏州': (31.2989, 120.5853),
+        '成都': (30.5728, 104.0668),
+        '重庆': (29.5630, 106.5516),
+        '西安': (34.3416, 108.9398),
+    }
+
+    def geocode(self, pairs):
+        return {(name, city): self._locate(name, city) for name, city in pairs}
+
+    def _locate(self, name, city):
+        center = self.CITY_CENTERS.get(city)
+        if center is None:
+            u, v = self._unit(f"city:{city}")
+            center = (22 + 18 * u, 100 + 21 * v)
+        u, v = self._unit(f"{city}:{name}")
+        return center[0] + 0.27 * (u - 0.5), center[1] + 0.3 * (v - 0.5)
+
+    @staticmethod
+    def _unit(text):
+        digest = hashlib.sha256(text.encode('utf-8')).digest()
+        return int.from_bytes(digest[:4], 'big') / 2 ** 32, int.from_bytes(digest[4:8], 'big') / 2 ** 32
+
+
+def create_geocoder(kind, amap_key=None):
+    if kind == 'amap':
+        return AMapGeocoder(amap_key)
+    if kind == 'stub':
+        return StubGeocoder()
+    raise ValueError(f"Unknown geocoder {kind!r}, expected 'amap' or 'stub'")
+
+
+class _Miss:
+    """A cached negative lookup: the geocoder didn't find the location, or failed (error)."""
+    __slots__ = ('expires', 'error')
+
+    def __init__(self, expires, error):
+        self.expires = expires
+        self.error = error
+
+
+class CoordinateCache:
+    """
+    Caches (name, city) -> (lat, lon) in front of a geocoder. Locations the geocoder
+    could not find, or failed on, are remembered for negative_ttl seconds so a
+    broken upstream isn't asked again on every request.
+
+    At most max_geocode_per_lookup unknown locations are geocoded per lookup, which
+    bounds the time a request spends on the geocoder; the rest count as unlocated
+    for this lookup (without being cached) and are geocoded by later ones.
+    """
+
+    def __init__(self, geocoder, max_entries=100000, negative_ttl=600, max_geocode_per_lookup=50):
+        self.geocoder = geocoder
+        self.max_entries = max_entries
+        self.negative_ttl = negative_ttl
+        self.max_geocode_per_lookup = max_geocode_per_lookup
+        self._entries = OrderedDict()  # (name, city) -> (lat, lon) or _Miss
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.geocode_errors = 0
+
+    def lookup(self, pairs):
+        """
+        Returns ({(name, city): (lat, lon) or None}, set of the pairs the geocoder
+        failed on) for the pairs, geocoding the unknown ones in one call.
+        """
+        pairs = set(pairs)
+        now = time.monotonic()
+        found = {}
+        failed = set()
+        with self._lock:
+            for pair in pairs:
+                entry = self._entries.get(pair)
+                if isinstance(entry, tuple):
+                    self._entries.move_to_end(pair)
+                    found[pair] = entry
+                elif entry is not None and entry.expires > now:
+                    found[pair] = None
+                    if entry.error:
+                        failed.add(pair)
+            self.hits += len(found)
+            self.misses += len(pairs) - len(found)
+
+        unknown = [pair for pair in pairs if pair not in found]
+        missing = unknown[:self.max_geocode_per_lookup]
+        for pair in unknown[self.max_geocode_per_lookup:]:
+            found[pair] = None
+        if missing:
+            try:
+                geocoded = self.geocoder.geocode(missing)
+            except Exception as e:
+                print(f"Geocoding failed: {e}")
+                geocoded = None
+            with self._lock:
+                error = geocoded is None
+                if error:
+                    self.geocode_errors += 1
+                    geocoded = {}
+                    failed.update(missing)
+                for pair in missing:
+                    coordinates = geocoded.get(pair)
+                    found[pair] = coordinates
+                    self._entries[pair] = coordinates if coordinates else _Miss(now + self.negative_ttl, error)
+                    self._entries.move_to_end(pair)
+                while len(self._entries) > self.max_entries:
+                    self._entries.popitem(last=False)
+        return found, failed
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'geocode_errors': self.geocode_errors,
+            }
+
+
+# --- Distances ---
+
+def haversine_matrix(coordinates):
+    """
+    Great-circle distances in km between all pairs of an (n, 2) array of
+    (lat, lon) degrees. Rows with NaN coordinates get NaN distances.
+    """
+    coordinates = np.asarray(coordinates, dtype=float).reshape(-1, 2)
+    lat = np.radians(coordinates[:, 0])
+    lon = np.radians(coordinates[:, 1])
+    dlat = lat[:, None] - lat[None, :]
+    dlon = lon[:, None] - lon[None, :]
+    a = np.sin(dlat / 2) ** 2 + np.cos(lat)[:, None] * np.cos(lat)[None, :] * np.sin(dlon / 2) ** 2
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def item_coordinates(items, coordinate_cache):
+    """
+    Returns (an (n, 2) array of the items' (lat, lon), NaN for items without a known
+    location; whether the geocoder failed on any of the locations).
+    """
+    pairs = {(item.location.name, item.location.city) for item in items if item.location}
+    found, failed = coordinate_cache.lookup(pairs) if pairs else ({}, set())
+    coordinates = np.full((len(items), 2), np.nan)
+    for index, item in enumerate(items):
+        point = found.get((item.location.name, item.location.city)) if item.location else None
+        if point:
+            coordinates[index] = point
+    return coordinates, bool(failed)
+
+
+def route_length(distances, order):
+    """Sum of the distances between consecutive positions of order, skipping unknown legs."""
+    if len(order) < 2:
+        return 0.0
+    legs = distances[np.asarray(order[:-1]), np.asarray(order[1:])]
+    return float(np.nansum(legs))
+
+
+def unlocated_items(distances):
+    """How many items of a distance matrix have no coordinates (NaN on the diagonal)."""
+    return int(np.isnan(np.diag(distances)).sum())
+
+
+def day_distance_matrices(plan, coordinate_cache):
+    """
+    Computes one distance matrix for all items of the plan and returns it sliced
+    per day, as ([(day, matrix)] in the plan's day order, whether geocoding failed).
+    """
+    items = [item for day in plan.days for item in day.items]
+    coordinates, geocoding_failed = item_coordinates(items, coordinate_cache)
+    distances = haversine_matrix(coordinates)
+    matrices = []
+    start = 0
+    for day in plan.days:
+        indices = np.arange(start, start + len(day.items))
+        start += len(day.items)
+        matrices.append((day, distances[np.ix_(indices, indices)]))
+    return matrices, geocoding_failed
+
+
+def plan_distances(plan, coordinate_cache):
+    """
+    Returns ([{'day_id', 'item_ids', 'matrix', 'legs', 'total', 'unlocated_items'}],
+    whether geocoding failed) in km for the plan's days, with None for distances
+    involving an item that has no known location.
+    """
+    days = []
+    matrices, geocoding_failed = day_distance_matrices(plan, coordinate_cache)
+    for day, matrix in matrices:
+        days.append({
+            'day_id': day.id,
+            'item_ids': [item.id for item in day.items],
+            'matrix': [[_km(value) for value in row] for row in matrix],
+            'legs': [_km(matrix[i, i + 1]) for i in range(len(day.items) - 1)],
+            'total': round(route_length(matrix, list(range(len(day.items)))), 3),
+            'unlocated_items': unlocated_items(matrix),
+        })
+    return days, geocoding_failed
+
+
+def _km(value):
+    return None if np.isnan(value) else round(float(value), 3)
+
+
+# --- Reordering ---
+
+def _solve_exact(distances, start_costs, end_costs):
+    """Held-Karp over a segment: the visiting order minimizing start + path + end cost."""
+    n = len(distances)
+    full = (1 << n) - 1
+    cost = np.full((1 << n, n), np.inf)
+    parent = np.full((1 << n, n), -1, dtype=int)
+    for j in range(n):
+        cost[1 << j, j] = start_costs[j]
+    for mask in range(1, full + 1):
+        for last in range(n):
+            if not mask & (1 << last) or np.isinf(cost[mask, last]):
+                continue
+            # Extend to every unvisited node at once
+            candidates = cost[mask, last] + distances[last]
+            for nxt in range(n):
+                if mask & (1 << nxt):
+                    continue
+                new_mask = mask | (1 << nxt)
+                if candidates[nxt] < cost[new_mask, nxt]:
+                    cost[new_mask, nxt] = candidates[nxt]
+                    parent[new_mask, nxt] = last
+    last = int(np.argmin(cost[full] + end_costs))
+    order, mask = [], full
+    while last != -1:
+        order.append(last)
+        mask, last = mask & ~(1 << last), parent[mask, last]
+    return order[::-1]
+
+
+def _solve_heuristic(distances, start_costs, end_costs, max_rounds=1000):
+    """Nearest neighbour followed by 2-opt, evaluating all reversals of a round as one matrix."""
+    n = len(distances)
+    # Node n is the previous anchor and node n + 1 the next one
+    extended = np.zeros((n + 2, n + 2))
+    extended[:n, :n] = distances
+    extended[n, :n] = extended[:n, n] = start_costs
+    extended[n + 1, :n] = extended[:n, n + 1] = end_costs
+
+    order = [int(np.argmin(start_costs))]
+    remaining = set(range(n)) - set(order)
+    while remaining:
+        candidates = sorted(remaining)
+        order.append(candidates[int(np.argmin(distances[order[-1], candidates]))])
+        remaining.discard(order[-1])
+
+    path = np.array([n] + order + [n + 1])
+    for _ in range(max_rounds):
+        # Reversing path[k+1..l] replaces edges (k, k+1) and (l, l+1) with (k, l) and (k+1, l+1)
+        edges = extended[path[:-1], path[1:]]
+        gains = (extended[path[:-1, None], path[None, :-1]] + extended[path[1:, None], path[None, 1:]]
+                 - edges[:, None] - edges[None, :])
+        gains[np.tril_indices(len(edges), 1)] = 0.0
+        k, l = np.unravel_index(np.argmin(gains), gains.shape)
+        if gains[k, l] >= -1e-9:
+            break
+        path[k + 1:l + 1] = path[k + 1:l + 1][::-1]
+    return [int(node) for node in path[1:-1]]
+
+
+def _solve_segment(distances, start_costs, end_costs):
+    if len(distances) < 2:
+        return list(range(len(distances)))
+    if len(distances) <= EXACT_SEGMENT_SIZE:
+        return _solve_exact(distances, start_costs, end_costs)
+    return _solve_heuristic(distances, start_costs, end_costs)
+
+
+def optimize_day_order(items, distances, fixed_item_ids=()):
+    """
+    Reorders one day's items (sorted by their current order) to shorten the route.
+    Hotels, fixed-time items (FIXED_ITEM_TYPES), items in fixed_item_ids and items
+    without coordinates keep their positions; the movable items between two of them
+    are reordered among themselves, accounting for the legs to both neighbours.
+    Returns the new order as indices into items.
+    """
+    unknown = np.isnan(np.diag(distances))
+    fixed = [item.item_type in FIXED_ITEM_TYPES or item.id in fixed_item_ids or unknown[index]
+             for index, item in enumerate(items)]
+    order = list(range(len(items)))
+    segment = []
+    for position in range(len(items) + 1):
+        if position < len(items) and not fixed[position]:
+            segment.append(position)
+            continue
+        if len(segment) > 1:
+            before = segment[0] - 1 if segment[0] > 0 else None
+            after = position if position < len(items) else None
+            sub = distances[np.ix_(segment, segment)]
+            # A neighbour without coordinates doesn't pull the route either way
+            start_costs = np.nan_to_num(distances[before, segment]) if before is not None else np.zeros(len(segment))
+            end_costs = np.nan_to_num(distances[segment, after]) if after is not None else np.zeros(len(segment))
+            solved = _solve_segment(sub, start_costs, end_costs)
+            for offset, index in enumerate(solved):
+                order[segment[0] + offset] = segment[index]
+        segment = []
+    return order
+
+
+def retime(items, order):
+    """
+    Moves the reordered items' times along with them. Each block of positions whose
+    items were shuffled among themselves keeps its overall time window and the gaps
+    between slots; every item keeps its own duration. Returns {item_id: (start_time,
+    end_time)} for the items whose times changed, leaving out blocks where any item
+    has no times.
+    """
+    changed = {}
+    position = 0
+    while position < len(items):
+        if order[position] == position:
+            position += 1
+            continue
+        # The smallest block starting here that holds a permutation of its own positions
+        end, highest = position, -1
+        while True:
+            highest = max(highest, order[end])
+            end += 1
+            if highest < end:
+                break
+        slots = items[position:end]
+        moved = [items[index] for index in order[position:end]]
+        if all(item.start_time and item.end_time for item in slots):
+            gaps = [max(slots[k + 1].start_time - slots[k].end_time, timedelta(0)) for k in range(len(slots) - 1)]
+            clock = slots[0].start_time
+            for k, item in enumerate(moved):
+                start, finish = clock, clock + (item.end_time - item.start_time)
+                if (start, finish) != (item.start_time, item.end_time):
+                    changed[item.id] = (start, finish)
+                clock = finish + (gaps[k] if k < len(gaps) else timedelta(0))
+        position = end
+    return changed
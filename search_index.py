@@ -0,0 +1,273 @@
+import math
+import queue
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+import models
+
+# Field weights: a hit in a title or place name says more than one in free text
+TITLE_WEIGHT = 3.0
+LOCATION_WEIGHT = 2.0
+TEXT_WEIGHT = 1.0
+
+_CJK_RANGES = '㐀-䶿一-鿿豈-﫿぀-ヿ가-힯'
+_TOKEN_RE = re.compile(f'[{_CJK_RANGES}]+|[^\\W_{_CJK_RANGES}]+')
+_CJK_RE = re.compile(f'[{_CJK_RANGES}]')
+
+
+def tokenize(text, for_query=False):
+    """
+    Splits text into search tokens: lowercased words for alphabetic scripts and
+    character n-grams for CJK runs, which have no word boundaries.
+
+    Indexed CJK text yields unigrams and bigrams; queries use bigrams only (or the
+    unigram for a single character) so that "茶馆" does not also match every "茶".
+    """
+    tokens = []
+    for run in _TOKEN_RE.findall((text or '').lower()):
+        if not _CJK_RE.match(run):
+            tokens.append(run)
+            continue
+        bigrams = [run[i:i + 2] for i in range(len(run) - 1)]
+        if for_query:
+            tokens.extend(bigrams or [run])
+        else:
+            tokens.extend(run)
+            tokens.extend(bigrams)
+    return tokens
+
+
+class SearchResult:
+    def __init__(self, plan_id, title, description, score, matches):
+        self.plan_id = plan_id
+        self.title = title
+        self.description = description
+        self.score = score
+        self.matches = matches  # texts of the items that matched
+
+    def to_dict(self):
+        return {
+            "plan_id": self.plan_id,
+            "title": self.title,
+            "description": self.description,
+            "score": self.score,
+            "matches": self.matches,
+        }
+
+
+class _UserIndex:
+    """The inverted index of one user's plans. Documents are a plan's header or one of its items."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sync_lock = threading.RLock()
+        self.synced_at = None  # monotonic time of the last comparison with the plan rows
+        self.postings = {}  # token -> {doc_id: weight}
+        self.docs = {}  # doc_id -> (plan_id, text, tokens)
+        self.plan_docs = {}  # plan_id -> [doc_id]
+        self.plans = {}  # plan_id -> (title, description, version)
+
+    def add_plan(self, plan):
+        self.remove_plan(plan.id)
+        self.plans[plan.id] = (plan.title, plan.description, plan.updated_at)
+        self._add_doc(plan.id, plan.id, plan.title, [(plan.title, TITLE_WEIGHT), (plan.description, TEXT_WEIGHT)])
+        for day in plan.days:
+            for item in day.items:
+                fields = [(item.description, TEXT_WEIGHT)]
+                text = item.description
+                if item.location:
+                    fields += [(item.location.name, LOCATION_WEIGHT), (item.location.city, LOCATION_WEIGHT)]
+                    text = f"{item.description} ({item.location.city or ''} {item.location.name or ''})"
+                self._add_doc(plan.id, item.id, text, fields)
+
+    def remove_plan(self, plan_id):
+        for doc_id in self.plan_docs.pop(plan_id, ()):
+            _, _, tokens = self.docs.pop(doc_id)
+            for token in tokens:
+                posting = self.postings[token]
+                posting.pop(doc_id, None)
+                if not posting:
+                    del self.postings[token]
+        self.plans.pop(plan_id, None)
+
+    def _add_doc(self, plan_id, doc_id, text, fields):
+        weights = Counter()
+        for value, weight in fields:
+            for token in tokenize(value):
+                weights[token] += weight
+        for token, weight in weights.items():
+            self.postings.setdefault(token, {})[doc_id] = weight
+        self.docs[doc_id] = (plan_id, text, list(weights))
+        self.plan_docs.setdefault(plan_id, []).append(doc_id)
+
+    def search(self, query):
+        query_tokens = set(tokenize(query, for_query=True))
+        if not query_tokens:
+            return []
+
+        # Only the posting lists of the query tokens are touched, so the cost
+        # depends on how common the terms are, not on how much is indexed
+        doc_count = len(self.docs)
+        plan_scores = Counter()
+        plan_tokens = {}
+        plan_matches = {}
+        for token in query_tokens:
+            posting = self.postings.get(token)
+            if not posting:
+                continue
+            idf = math.log(1 + doc_count / len(posting))
+            for doc_id, weight in posting.items():
+                plan_id = self.docs[doc_id][0]
+                plan_scores[plan_id] += idf * weight
+                plan_tokens.setdefault(plan_id, set()).add(token)
+                if doc_id != plan_id:
+                    plan_matches.setdefault(plan_id, Counter())[doc_id] += idf * weight
+
+        results = []
+        for plan_id, score in plan_scores.items():
+            # Plans covering more of the query rank first, then by weighted tf-idf
+            coverage = len(plan_tokens[plan_id]) / len(query_tokens)
+            title, description, _ = self.plans[plan_id]
+            matches = [self.docs[doc_id][1] for doc_id, _ in plan_matches.get(plan_id, Counter()).most_common(3)]
+            results.append((coverage, score, SearchResult(plan_id, title, description, round(coverage * score, 4), matches)))
+        results.sort(key=lambda result: (result[0], result[1]), reverse=True)
+        return [result for _, _, result in results]
+
+
+class SearchIndex:
+    """
+    Per-user full-text search over plan titles and descriptions, item descriptions
+    and location names and cities.
+
+    A user's plans are indexed on their first search, from their plan rows and
+    the plans new to the index (the users searched least recently are evicted
+    beyond max_users). After that, searches only read the index. Plans reported
+    by the plan change listener are re-indexed, and a user's index is compared
+    with their plan versions again when it is older than refresh_interval, which
+    picks up changes made by other worker processes. Once start() has run, both
+    happen on a background thread; without it they happen on the next search.
+
+    Each user's index has its own lock, so searches of different users don't wait
+    for each other or for re-indexing.
+    """
+
+    def __init__(self, max_users=1000, fetch_batch_size=50, refresh_interval=30.0):
+        self.max_users = max_users
+        self.fetch_batch_size = fetch_batch_size
+        self.refresh_interval = refresh_interval
+        self._users = OrderedDict()  # user_id -> _UserIndex, least recently searched first
+        self._lock = threading.Lock()  # guards _users
+        self._work = queue.Queue()  # ('plan', plan_id) or ('user', user_id)
+        self._thread = None
+
+    def start(self):
+        """Starts the background thread that keeps the indexed users up to date."""
+        with self._lock:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name='search-index', daemon=True)
+                self._thread.start()
+
+    def on_plan_changed(self, plan_id):
+        if self._thread is not None:
+            self._work.put(('plan', plan_id))
+            return
+        # Without the background thread the owner's index is brought up to date on its next search
+        for index in self._indexes_with_plan(plan_id):
+            with index.lock:
+                index.remove_plan(plan_id)
+            index.synced_at = None
+
+    def search(self, user_id, query, page=1, per_page=10):
+        """Returns (results for the page, total number of matching plans)."""
+        index = self._user_index(user_id)
+        with index.sync_lock:
+            if index.synced_at is None:
+                self.sync_user(user_id, index)
+        if time.monotonic() - index.synced_at > self.refresh_interval:
+            if self._thread is not None:
+                # Marked as synced right away so the refresh is only queued once
+                index.synced_at = time.monotonic()
+                self._work.put(('user', user_id))
+            else:
+                self.sync_user(user_id, index)
+        with index.lock:
+            results = index.search(query)
+        start = (max(page, 1) - 1) * per_page
+        return results[start:start + per_page], len(results)
+
+    def sync_user(self, user_id, index):
+        """Re-indexes the user's new and changed plans and drops the deleted ones, comparing plan versions."""
+        with index.sync_lock:
+            synced_at = time.monotonic()
+            current = {plan.id: plan.updated_at for plan in models.get_plan_summaries_by_user(user_id)}
+            with index.lock:
+                for plan_id in [plan_id for plan_id in index.plans if plan_id not in current]:
+                    index.remove_plan(plan_id)
+                stale = [plan_id for plan_id, version in current.items()
+                         if plan_id not in index.plans or index.plans[plan_id][2] != version]
+            for start in range(0, len(stale), self.fetch_batch_size):
+                plans = models.get_plans(stale[start:start + self.fetch_batch_size])
+                with index.lock:
+                    for plan in plans:
+                        if plan.user_id == user_id:
+                            index.add_plan(plan)
+            index.synced_at = synced_at
+
+    def reindex(self, plan_ids):
+        """Re-reads the given plans into the indexes of their (indexed) users; deleted plans are dropped."""
+        plan_ids = set(plan_ids)
+        plans = models.get_plans(list(plan_ids))
+        for plan in plans:
+            with self._lock:
+                index = self._users.get(plan.user_id)
+            if index is not None:
+                with index.lock:
+                    index.add_plan(plan)
+        for plan_id in plan_ids - {plan.id for plan in plans}:
+            for index in self._indexes_with_plan(plan_id):
+                with index.lock:
+                    index.remove_plan(plan_id)
+
+    def _user_index(self, user_id):
+        with self._lock:
+            index = self._users.pop(user_id, None) or _UserIndex()
+            self._users[user_id] = index
+            while len(self._users) > self.max_users:
+                self._users.popitem(last=False)
+            return index
+
+    def _indexes_with_plan(self, plan_id):
+        with self._lock:
+            indexes = list(self._users.values())
+        return [index for index in indexes if plan_id in index.plans]
+
+    def _run(self):
+        while True:
+            plan_ids, user_ids = set(), set()
+            kind, key = self._work.get()
+            while True:
+                (plan_ids if kind == 'plan' else user_ids).add(key)
+                if len(plan_ids) >= self.fetch_batch_size:
+                    break
+                try:
+                    kind, key = self._work.get_nowait()
+                except queue.Empty:
+                    break
+            try:
+                if plan_ids:
+                    self.reindex(plan_ids)
+                for user_id in user_ids:
+                    with self._lock:
+                        index = self._users.get(user_id)
+                    if index is not None:
+                        self.sync_user(user_id, index)
+            except Exception as e:
+                print(f"Search index update failed: {e}")
+                # The affected users are compared with their plan versions on their next search
+                with self._lock:
+                    indexes = list(self._users.items())
+                for user_id, index in indexes:
+                    if user_id in user_ids or plan_ids & index.plans.keys():
+                        index.synced_at = 0.0
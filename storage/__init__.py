@@ -0,0 +1,17 @@
+import os
+
+from .base import PlanRepository
+
+STORAGE_BACKENDS = ('supabase', 'sqlite')
+
+
+def create_repository(backend):
+    """Builds the configured PlanRepository ('supabase' or 'sqlite')."""
+    if backend == 'supabase':
+        # Imported here so the SQLite backend works without the supabase client installed
+        from .supabase_backend import SupabaseRepository
+        return SupabaseRepository(os.environ.get("SUPABASE_URL"), os.environ.get("SUPABASE_ANON_KEY"))
+    if backend == 'sqlite':
+        from .sqlite_backend import SQLiteRepository
+        return SQLiteRepository(os.environ.get("SQLITE_PATH", "travel_planner.db"))
+    raise ValueError(f"Unknown storage backend {backend!r}, expected one of {', '.join(STORAGE_BACKENDS)}")
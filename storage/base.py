@@ -0,0 +1,156 @@
+from abc import ABC, abstractmethod
+
+
+class PlanRepository(ABC):
+    """
+    The storage interface behind models. Backends implement every method, or
+    fail to instantiate.
+
+    Backends exchange plain dict rows named after the tables and columns in the
+    schema note at the bottom of models.py. Plan trees are nested the way the
+    Supabase API returns them:
+
+        plan["days"][i]["itinerary_items"][j]["locations"]       (a row or None)
+        plan["days"][i]["itinerary_items"][j]["actual_costs"]    (a list of rows)
+
+    Versioning (plans.updated_at) and change notifications are handled by models,
+    which calls touch_plans() after every mutation.
+    """
+
+    # --- Auth ---
+
+    @abstractmethod
+    def sign_in(self, email, password):
+        """Returns (user_id, email), or raises on bad credentials."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def sign_up(self, email, password):
+        """Creates the account and returns (user_id, email)."""
+        raise NotImplementedError
+
+    # --- Plans ---
+
+    @abstractmethod
+    def insert_plan_trees(self, plan_rows, day_rows, item_rows, cost_rows, chunk_size):
+        """Inserts plans with their days, items and costs, in batches of chunk_size rows."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plan(self, plan_id):
+        """Returns the nested plan tree, or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plans(self, plan_ids):
+        """Returns the nested plan trees with the given ids, in no particular order."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plans_by_user(self, user_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plans_page(self, user_id, after, limit):
+        """Returns up to limit plan trees ordered by id, with ids greater than after."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plan_summary(self, plan_id):
+        """Returns the plan row (without days), or None."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plan_summaries_by_user(self, user_id):
+        """Returns the user's plan rows, newest first."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_days(self, plan_id, offset, limit):
+        """
+        Returns (day trees ordered by date, skipping the first offset, total number
+        of days). limit may be None for all the remaining days.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_plan_cost_totals(self, plan_id):
+        """Returns the plan's (estimated, actual) cost totals."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_plan(self, plan_id):
+        """Deletes the plan with everything in it and its no longer used locations. Returns False if it didn't exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def touch_plans(self, plan_ids, updated_at):
+        raise NotImplementedError
+
+    @abstractmethod
+    def plan_ids_for_days(self, day_ids):
+        """Returns the set of plan ids the days belong to."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def plan_id_for_item(self, item_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def user_ids_for_items(self, item_ids):
+        """Returns {item_id: the owning plan's user_id} for the items that exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def plan_id_for_cost(self, cost_id):
+        raise NotImplementedError
+
+    # --- Locations ---
+
+    @abstractmethod
+    def resolve_locations(self, pairs):
+        """Maps each (name, city) pair to a location id, creating the missing locations."""
+        raise NotImplementedError
+
+    # --- Itinerary items ---
+
+    @abstractmethod
+    def insert_itinerary_item(self, row):
+        """Inserts the row and returns it as stored, or None on failure."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_itinerary_items(self, item_ids):
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_itinerary_item(self, item_id, fields):
+        """Updates the item and returns the updated row, or None if it doesn't exist."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def update_itinerary_items(self, updates):
+        """
+        Writes {item_id: fields} in one round trip, touching only the given columns
+        of each item, and returns the rows as stored. Missing items are left out.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_itinerary_item(self, item_id):
+        raise NotImplementedError
+
+    # --- Actual costs ---
+
+    @abstractmethod
+    def create_actual_cost(self, row):
+        """Inserts the row and returns it as stored, or None on failure."""
+        raise NotImplementedError
+
+    @abstractmethod
+    def get_actual_cost(self, cost_id):
+        raise NotImplementedError
+
+    @abstractmethod
+    def delete_actual_cost(self, cost_id):
+        raise NotImplementedError
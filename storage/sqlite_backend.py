@@ -0,0 +1,387 @@
+import sqlite3
+import threading
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from .base import PlanRepository
+
+# The schema documented at the bottom of models.py, plus a local users table
+# standing in for Supabase Auth. The indexes cover every lookup the app makes:
+# plans by user, days by plan, items by day, costs by item, locations by
+# (name, city) and items by location (for the orphan check in delete_plan).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    id TEXT PRIMARY KEY,
+    email TEXT NOT NULL UNIQUE,
+    password_hash TEXT NOT NULL,
+    created_at TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS plans (
+    id TEXT PRIMARY KEY,
+    user_id TEXT NOT NULL,
+    title TEXT,
+    description TEXT,
+    created_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now')),
+    updated_at TEXT NOT NULL DEFAULT (strftime('%Y-%m-%dT%H:%M:%S+00:00', 'now'))
+);
+CREATE INDEX IF NOT EXISTS plans_user_id ON plans (user_id, created_at);
+CREATE TABLE IF NOT EXISTS days (
+    id TEXT PRIMARY KEY,
+    plan_id TEXT NOT NULL REFERENCES plans (id) ON DELETE CASCADE,
+    date TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS days_plan_id ON days (plan_id, date);
+CREATE TABLE IF NOT EXISTS locations (
+    id TEXT PRIMARY KEY,
+    name TEXT,
+    city TEXT
+);
+CREATE INDEX IF NOT EXISTS locations_name_city ON locations (name, city);
+CREATE TABLE IF NOT EXISTS itinerary_items (
+    id TEXT PRIMARY KEY,
+    day_id TEXT NOT NULL REFERENCES days (id) ON DELETE CASCADE,
+    location_id TEXT REFERENCES locations (id),
+    item_type TEXT,
+    description TEXT,
+    start_time TEXT,
+    end_time TEXT,
+    estimated_cost REAL,
+    "order" INTEGER
+);
+CREATE INDEX IF NOT EXISTS itinerary_items_day_id ON itinerary_items (day_id, "order");
+CREATE INDEX IF NOT EXISTS itinerary_items_location_id ON itinerary_items (location_id);
+CREATE TABLE IF NOT EXISTS actual_costs (
+    id TEXT PRIMARY KEY,
+    itinerary_item_id TEXT NOT NULL REFERENCES itinerary_items (id) ON DELETE CASCADE,
+    name TEXT,
+    amount REAL
+);
+CREATE INDEX IF NOT EXISTS actual_costs_itinerary_item_id ON actual_costs (itinerary_item_id);
+"""
+
+TABLE_COLUMNS = {
+    'plans': ('id', 'user_id', 'title', 'description', 'created_at', 'updated_at'),
+    'days': ('id', 'plan_id', 'date'),
+    'locations': ('id', 'name', 'city'),
+    'itinerary_items': ('id', 'day_id', 'location_id', 'item_type', 'description', 'start_time', 'end_time', 'estimated_cost', 'order'),
+    'actual_costs': ('id', 'itinerary_item_id', 'name', 'amount'),
+}
+
+# Keeps "IN (?, ?, ...)" lists well below SQLite's bound parameter limit
+MAX_IN_PARAMS = 500
+
+
+def _chunks(rows, size):
+    rows = list(rows)
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+def _placeholders(values):
+    return ', '.join('?' for _ in values)
+
+
+def _quote(column):
+    # "order" is a keyword, so every column name is quoted
+    return f'"{column}"'
+
+
+class SQLiteRepository(PlanRepository):
+    """
+    A local SQLite backend, for running the app, tests and benchmarks offline.
+
+    A plan tree, or any number of them, is loaded with four queries: plans, days,
+    items joined with their locations, and costs. File databases use one
+    connection per thread in WAL mode, so readers don't block each other;
+    ':memory:' databases share a single connection behind a lock.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._memory_lock = None
+        if path == ':memory:':
+            self._memory_lock = threading.RLock()
+            self._memory_connection = self._open(path)
+        with self._connection() as conn:
+            conn.executescript(SCHEMA)
+
+    # --- Connections ---
+
+    def _open(self, path):
+        conn = sqlite3.connect(path, timeout=30, isolation_level=None, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute('PRAGMA foreign_keys = ON')
+        if path != ':memory:':
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+        return conn
+
+    @contextmanager
+    def _connection(self):
+        if self._memory_lock is not None:
+            with self._memory_lock:
+                yield self._memory_connection
+            return
+        conn = getattr(self._local, 'connection', None)
+        if conn is None:
+            conn = self._local.connection = self._open(self.path)
+        yield conn
+
+    @contextmanager
+    def _transaction(self):
+        with self._connection() as conn:
+            conn.execute('BEGIN IMMEDIATE')
+            try:
+                yield conn
+            except BaseException:
+                conn.execute('ROLLBACK')
+                raise
+            conn.execute('COMMIT')
+
+    def _query(self, sql, params=()):
+        with self._connection() as conn:
+            return [dict(row) for row in conn.execute(sql, params)]
+
+    def _insert(self, conn, table, rows):
+        if not rows:
+            return
+        columns = [column for column in rows[0] if column in TABLE_COLUMNS[table]]
+        sql = f'INSERT INTO {table} ({", ".join(map(_quote, columns))}) VALUES ({_placeholders(columns)})'
+        conn.executemany(sql, [[row.get(column) for column in columns] for row in rows])
+
+    # --- Auth ---
+
+    def sign_in(self, email, password):
+        rows = self._query('SELECT id, email, password_hash FROM users WHERE email = ?', (email,))
+        if not rows or not check_password_hash(rows[0]['password_hash'], password or ''):
+            raise Exception("Invalid login credentials")
+        return rows[0]['id'], rows[0]['email']
+
+    def sign_up(self, email, password):
+        if not email or not password:
+            raise Exception("Email and password are required")
+        user_id = str(uuid.uuid4())
+        try:
+            with self._transaction() as conn:
+                conn.execute('INSERT INTO users (id, email, password_hash, created_at) VALUES (?, ?, ?, ?)',
+                             (user_id, email, generate_password_hash(password), datetime.now(timezone.utc).isoformat()))
+        except sqlite3.IntegrityError:
+            raise Exception("User already registered")
+        return user_id, email
+
+    # --- Plans ---
+
+    def insert_plan_trees(self, plan_rows, day_rows, item_rows, cost_rows, chunk_size):
+        with self._transaction() as conn:
+            for table, rows in (('plans', plan_rows), ('days', day_rows), ('itinerary_items', item_rows), ('actual_costs', cost_rows)):
+                for chunk in _chunks(rows, chunk_size):
+                    self._insert(conn, table, chunk)
+
+    def get_plan(self, plan_id):
+        plans = self._plan_trees(self._query('SELECT * FROM plans WHERE id = ?', (plan_id,)))
+        return plans[0] if plans else None
+
+    def get_plans(self, plan_ids):
+        plan_rows = []
+        for chunk in _chunks(plan_ids, MAX_IN_PARAMS):
+            plan_rows += self._query(f'SELECT * FROM plans WHERE id IN ({_placeholders(chunk)})', chunk)
+        return self._plan_trees(plan_rows)
+
+    def get_plans_by_user(self, user_id):
+        return self._plan_trees(self._query('SELECT * FROM plans WHERE user_id = ?', (user_id,)))
+
+    def get_plans_page(self, user_id, after, limit):
+        conditions, params = [], []
+        if user_id:
+            conditions.append('user_id = ?')
+            params.append(user_id)
+        if after:
+            conditions.append('id > ?')
+            params.append(after)
+        where = f"WHERE {' AND '.join(conditions)}" if conditions else ''
+        return self._plan_trees(self._query(f'SELECT * FROM plans {where} ORDER BY id LIMIT ?', params + [limit]))
+
+    def get_plan_summary(self, plan_id):
+        rows = self._query('SELECT * FROM plans WHERE id = ?', (plan_id,))
+        return rows[0] if rows else None
+
+    def get_plan_summaries_by_user(self, user_id):
+        return self._query('SELECT * FROM plans WHERE user_id = ? ORDER BY created_at DESC', (user_id,))
+
+    def get_days(self, plan_id, offset, limit):
+        total = self._query('SELECT COUNT(*) AS total FROM days WHERE plan_id = ?', (plan_id,))[0]['total']
+        # LIMIT -1 is no limit, so an offset alone still applies
+        day_rows = self._query('SELECT * FROM days WHERE plan_id = ? ORDER BY date LIMIT ? OFFSET ?',
+                               (plan_id, -1 if limit is None else limit, offset or 0))
+        return self._day_trees(day_rows), total
+
+    def get_plan_cost_totals(self, plan_id):
+        row = self._query(
+            'SELECT'
+            ' (SELECT COALESCE(SUM(i.estimated_cost), 0) FROM itinerary_items i JOIN days d ON d.id = i.day_id WHERE d.plan_id = ?) AS estimated,'
+            ' (SELECT COALESCE(SUM(c.amount), 0) FROM actual_costs c JOIN itinerary_items i ON i.id = c.itinerary_item_id'
+            '  JOIN days d ON d.id = i.day_id WHERE d.plan_id = ?) AS actual',
+            (plan_id, plan_id))[0]
+        return float(row['estimated']), float(row['actual'])
+
+    def delete_plan(self, plan_id):
+        with self._transaction() as conn:
+            location_ids = [row[0] for row in conn.execute(
+                'SELECT DISTINCT i.location_id FROM itinerary_items i JOIN days d ON d.id = i.day_id'
+                ' WHERE d.plan_id = ? AND i.location_id IS NOT NULL', (plan_id,))]
+            if conn.execute('DELETE FROM plans WHERE id = ?', (plan_id,)).rowcount == 0:
+                return False
+            # Locations are shared by (name, city); keep the ones still in use
+            for chunk in _chunks(location_ids, MAX_IN_PARAMS):
+                conn.execute(
+                    f'DELETE FROM locations WHERE id IN ({_placeholders(chunk)})'
+                    ' AND NOT EXISTS (SELECT 1 FROM itinerary_items i WHERE i.location_id = locations.id)', chunk)
+        return True
+
+    def touch_plans(self, plan_ids, updated_at):
+        plan_ids = list(plan_ids)
+        with self._transaction() as conn:
+            for chunk in _chunks(plan_ids, MAX_IN_PARAMS):
+                conn.execute(f'UPDATE plans SET updated_at = ? WHERE id IN ({_placeholders(chunk)})', [updated_at] + chunk)
+
+    def plan_ids_for_days(self, day_ids):
+        plan_ids = set()
+        for chunk in _chunks(day_ids, MAX_IN_PARAMS):
+            plan_ids.update(row['plan_id'] for row in self._query(f'SELECT plan_id FROM days WHERE id IN ({_placeholders(chunk)})', chunk))
+        return plan_ids
+
+    def plan_id_for_item(self, item_id):
+        rows = self._query('SELECT d.plan_id FROM itinerary_items i JOIN days d ON d.id = i.day_id WHERE i.id = ?', (item_id,))
+        return rows[0]['plan_id'] if rows else None
+
+    def user_ids_for_items(self, item_ids):
+        owners = {}
+        for chunk in _chunks(item_ids, MAX_IN_PARAMS):
+            rows = self._query(
+                'SELECT i.id, p.user_id FROM itinerary_items i JOIN days d ON d.id = i.day_id JOIN plans p ON p.id = d.plan_id'
+                f' WHERE i.id IN ({_placeholders(chunk)})', chunk)
+            owners.update((row['id'], row['user_id']) for row in rows)
+        return owners
+
+    def plan_id_for_cost(self, cost_id):
+        rows = self._query(
+            'SELECT d.plan_id FROM actual_costs c JOIN itinerary_items i ON i.id = c.itinerary_item_id'
+            ' JOIN days d ON d.id = i.day_id WHERE c.id = ?', (cost_id,))
+        return rows[0]['plan_id'] if rows else None
+
+    # --- Locations ---
+
+    def resolve_locations(self, pairs):
+        pairs = set(pairs)
+        if not pairs:
+            return {}
+        location_ids = {}
+        with self._transaction() as conn:
+            for names in _chunks(sorted({name for name, _ in pairs}), MAX_IN_PARAMS):
+                for row in conn.execute(f'SELECT id, name, city FROM locations WHERE name IN ({_placeholders(names)})', names):
+                    if (row['name'], row['city']) in pairs:
+                        location_ids.setdefault((row['name'], row['city']), row['id'])
+            missing = [{'id': str(uuid.uuid4()), 'name': name, 'city': city} for name, city in pairs if (name, city) not in location_ids]
+            self._insert(conn, 'locations', missing)
+        location_ids.update({(row['name'], row['city']): row['id'] for row in missing})
+        return location_ids
+
+    # --- Itinerary items ---
+
+    def insert_itinerary_item(self, row):
+        with self._transaction() as conn:
+            self._insert(conn, 'itinerary_items', [row])
+        return self._item(row['id'])
+
+    def get_itinerary_items(self, item_ids):
+        rows = []
+        for chunk in _chunks(item_ids, MAX_IN_PARAMS):
+            rows += self._query(f'SELECT * FROM itinerary_items WHERE id IN ({_placeholders(chunk)})', chunk)
+        return rows
+
+    def update_itinerary_item(self, item_id, fields):
+        columns = [column for column in fields if column in TABLE_COLUMNS['itinerary_items'] and column != 'id']
+        if columns:
+            with self._transaction() as conn:
+                conn.execute(f'UPDATE itinerary_items SET {", ".join(_quote(c) + " = ?" for c in columns)} WHERE id = ?',
+                             [fields[column] for column in columns] + [item_id])
+        return self._item(item_id)
+
+    def update_itinerary_items(self, updates):
+        if not updates:
+            return []
+        # One UPDATE statement per distinct column set, run for all its items
+        by_columns = {}
+        for item_id, fields in updates.items():
+            columns = tuple(column for column in fields if column in TABLE_COLUMNS['itinerary_items'] and column != 'id')
+            if columns:
+                by_columns.setdefault(columns, []).append([fields[column] for column in columns] + [item_id])
+        if by_columns:
+            with self._transaction() as conn:
+                for columns, params in by_columns.items():
+                    conn.executemany(f'UPDATE itinerary_items SET {", ".join(_quote(c) + " = ?" for c in columns)} WHERE id = ?', params)
+        return self.get_itinerary_items(list(updates))
+
+    def delete_itinerary_item(self, item_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM itinerary_items WHERE id = ?', (item_id,))
+
+    def _item(self, item_id):
+        rows = self._query('SELECT * FROM itinerary_items WHERE id = ?', (item_id,))
+        return rows[0] if rows else None
+
+    # --- Actual costs ---
+
+    def create_actual_cost(self, row):
+        with self._transaction() as conn:
+            self._insert(conn, 'actual_costs', [row])
+        return self.get_actual_cost(row['id'])
+
+    def get_actual_cost(self, cost_id):
+        rows = self._query('SELECT * FROM actual_costs WHERE id = ?', (cost_id,))
+        return rows[0] if rows else None
+
+    def delete_actual_cost(self, cost_id):
+        with self._transaction() as conn:
+            conn.execute('DELETE FROM actual_costs WHERE id = ?', (cost_id,))
+
+    # --- Plan trees ---
+
+    def _plan_trees(self, plan_rows):
+        days_by_plan = {}
+        plan_ids = [plan['id'] for plan in plan_rows]
+        for chunk in _chunks(plan_ids, MAX_IN_PARAMS):
+            day_rows = self._query(f'SELECT * FROM days WHERE plan_id IN ({_placeholders(chunk)}) ORDER BY date', chunk)
+            for day in self._day_trees(day_rows):
+                days_by_plan.setdefault(day['plan_id'], []).append(day)
+        for plan in plan_rows:
+            plan['days'] = days_by_plan.get(plan['id'], [])
+        return plan_rows
+
+    def _day_trees(self, day_rows):
+        """Attaches items (with locations) and costs to the days, with one query each."""
+        items_by_day = {}
+        costs_by_item = {}
+        day_ids = [day['id'] for day in day_rows]
+        for chunk in _chunks(day_ids, MAX_IN_PARAMS):
+            params = _placeholders(chunk)
+            item_rows = self._query(
+                'SELECT i.*, l.name AS location_name, l.city AS location_city FROM itinerary_items i'
+                f' LEFT JOIN locations l ON l.id = i.location_id WHERE i.day_id IN ({params})', chunk)
+            cost_rows = self._query(
+                'SELECT c.* FROM actual_costs c JOIN itinerary_items i ON i.id = c.itinerary_item_id'
+                f' WHERE i.day_id IN ({params})', chunk)
+            for cost in cost_rows:
+                costs_by_item.setdefault(cost['itinerary_item_id'], []).append(cost)
+            for item in item_rows:
+                name, city = item.pop('location_name'), item.pop('location_city')
+                item['locations'] = {'id': item['location_id'], 'name': name, 'city': city} if item['location_id'] else None
+                item['actual_costs'] = costs_by_item.get(item['id'], [])
+                items_by_day.setdefault(item['day_id'], []).append(item)
+        for day in day_rows:
+            day['itinerary_items'] = items_by_day.get(day['id'], [])
+        return day_rows
@@ -0,0 +1,190 @@
+import uuid
+
+from supabase import create_client, Client
+
+from .base import PlanRepository
+
+PLAN_TREE_COLUMNS = "*, days(*, itinerary_items(*, locations(*), actual_costs(*)))"
+DAY_TREE_COLUMNS = "*, itinerary_items(*, locations(*), actual_costs(*))"
+PLAN_SUMMARY_COLUMNS = 'id, user_id, title, description, created_at, updated_at'
+
+# Location lookups are chunked by name to keep the request URLs short
+LOCATION_LOOKUP_CHUNK_SIZE = 100
+
+
+def _chunks(rows, size):
+    rows = list(rows)
+    for start in range(0, len(rows), size):
+        yield rows[start:start + size]
+
+
+class SupabaseRepository(PlanRepository):
+    def __init__(self, url, key):
+        self.client: Client = create_client(url, key)
+
+    # --- Auth ---
+
+    def sign_in(self, email, password):
+        user = self.client.auth.sign_in_with_password({"email": email, "password": password}).user
+        return user.id, user.email
+
+    def sign_up(self, email, password):
+        user = self.client.auth.sign_up({"email": email, "password": password}).user
+        return user.id, user.email
+
+    # --- Plans ---
+
+    def insert_plan_trees(self, plan_rows, day_rows, item_rows, cost_rows, chunk_size):
+        # Parents first, so foreign keys are satisfied
+        for table, rows in (('plans', plan_rows), ('days', day_rows), ('itinerary_items', item_rows), ('actual_costs', cost_rows)):
+            for chunk in _chunks(rows, chunk_size):
+                data = self.client.table(table).insert(chunk).execute()
+                if not data.data:
+                    raise Exception(f"Failed to insert into {table}")
+
+    def get_plan(self, plan_id):
+        plan_data = self.client.table('plans').select(PLAN_TREE_COLUMNS).eq('id', plan_id).execute()
+        return plan_data.data[0] if plan_data.data else None
+
+    def get_plans(self, plan_ids):
+        return self.client.table('plans').select(PLAN_TREE_COLUMNS).in_('id', list(plan_ids)).execute().data
+
+    def get_plans_by_user(self, user_id):
+        return self.client.table('plans').select(PLAN_TREE_COLUMNS).eq('user_id', user_id).execute().data
+
+    def get_plans_page(self, user_id, after, limit):
+        query = self.client.table('plans').select(PLAN_TREE_COLUMNS).order('id').limit(limit)
+        if user_id:
+            query = query.eq('user_id', user_id)
+        if after:
+            query = query.gt('id', after)
+        return query.execute().data
+
+    def get_plan_summary(self, plan_id):
+        plan_data = self.client.table('plans').select(PLAN_SUMMARY_COLUMNS).eq('id', plan_id).execute()
+        return plan_data.data[0] if plan_data.data else None
+
+    def get_plan_summaries_by_user(self, user_id):
+        return self.client.table('plans').select(PLAN_SUMMARY_COLUMNS).eq('user_id', user_id).order('created_at', desc=True).execute().data
+
+    def get_days(self, plan_id, offset, limit):
+        query = self.client.table('days').select(DAY_TREE_COLUMNS, count='exact').eq('plan_id', plan_id).order('date')
+        if limit is not None:
+            query = query.range(offset, offset + limit - 1)
+        elif offset:
+            query = query.offset(offset)
+        days_data = query.execute()
+        return days_data.data, days_data.count
+
+    def get_plan_cost_totals(self, plan_id):
+        days_data = self.client.table('days').select('itinerary_items(estimated_cost, actual_costs(amount))').eq('plan_id', plan_id).execute()
+        estimated = actual = 0.0
+        for day in days_data.data:
+            for item in day.get('itinerary_items', []):
+                estimated += item.get('estimated_cost') or 0.0
+                actual += sum(cost.get('amount') or 0.0 for cost in item.get('actual_costs', []))
+        return estimated, actual
+
+    def delete_plan(self, plan_id):
+        # 1. Get the plan's location_ids
+        plan_data = self.client.table('plans').select('id, days(itinerary_items(location_id))').eq('id', plan_id).execute()
+        if not plan_data.data:
+            return False
+        location_ids = {
+            item['location_id']
+            for day in plan_data.data[0].get('days', [])
+            for item in day.get('itinerary_items', [])
+            if item.get('location_id')
+        }
+
+        # 2. Delete the plan, which will cascade to days, itinerary_items, and actual_costs
+        self.client.table('plans').delete().eq('id', plan_id).execute()
+
+        # 3. Delete the now-orphaned locations. Locations are shared by (name, city),
+        # so keep the ones other plans still refer to.
+        if location_ids:
+            still_used = self.client.table('itinerary_items').select('location_id').in_('location_id', list(location_ids)).execute()
+            orphaned = location_ids - {row['location_id'] for row in still_used.data}
+            if orphaned:
+                self.client.table('locations').delete().in_('id', list(orphaned)).execute()
+        return True
+
+    def touch_plans(self, plan_ids, updated_at):
+        self.client.table('plans').update({'updated_at': updated_at}).in_('id', list(plan_ids)).execute()
+
+    def plan_ids_for_days(self, day_ids):
+        days_data = self.client.table('days').select('plan_id').in_('id', list(day_ids)).execute()
+        return {day['plan_id'] for day in days_data.data}
+
+    def plan_id_for_item(self, item_id):
+        data = self.client.table('itinerary_items').select('days(plan_id)').eq('id', item_id).execute()
+        if not data.data or not data.data[0].get('days'):
+            return None
+        return data.data[0]['days']['plan_id']
+
+    def user_ids_for_items(self, item_ids):
+        data = self.client.table('itinerary_items').select('id, days(plans(user_id))').in_('id', list(item_ids)).execute()
+        return {
+            row['id']: ((row.get('days') or {}).get('plans') or {}).get('user_id')
+            for row in data.data
+        }
+
+    def plan_id_for_cost(self, cost_id):
+        data = self.client.table('actual_costs').select('itinerary_items(days(plan_id))').eq('id', cost_id).execute()
+        if not data.data or not data.data[0].get('itinerary_items'):
+            return None
+        return (data.data[0]['itinerary_items'].get('days') or {}).get('plan_id')
+
+    # --- Locations ---
+
+    def resolve_locations(self, pairs):
+        pairs = set(pairs)
+        location_ids = {}
+        for names in _chunks(sorted({name for name, _ in pairs}), LOCATION_LOOKUP_CHUNK_SIZE):
+            location_data = self.client.table('locations').select('id, name, city').in_('name', names).execute()
+            for row in location_data.data:
+                if (row['name'], row['city']) in pairs:
+                    location_ids.setdefault((row['name'], row['city']), row['id'])
+
+        missing = [{'id': str(uuid.uuid4()), 'name': name, 'city': city} for name, city in pairs if (name, city) not in location_ids]
+        for chunk in _chunks(missing, 500):
+            self.client.table('locations').insert(chunk).execute()
+        location_ids.update({(row['name'], row['city']): row['id'] for row in missing})
+        return location_ids
+
+    # --- Itinerary items ---
+
+    def insert_itinerary_item(self, row):
+        new_item = self.client.table('itinerary_items').insert(row).execute()
+        return new_item.data[0] if new_item.data else None
+
+    def get_itinerary_items(self, item_ids):
+        return self.client.table('itinerary_items').select('*').in_('id', list(item_ids)).execute().data
+
+    def update_itinerary_item(self, item_id, fields):
+        response = self.client.table('itinerary_items').update(fields).eq('id', item_id).execute()
+        return response.data[0] if response.data else None
+
+    def update_itinerary_items(self, updates):
+        # PostgREST applies one set of values per PATCH, so the per-item values go
+        # through the update_itinerary_items function (see the schema note in models)
+        if not updates:
+            return []
+        payload = [dict(fields, id=item_id) for item_id, fields in updates.items()]
+        return self.client.rpc('update_itinerary_items', {'updates': payload}).execute().data
+
+    def delete_itinerary_item(self, item_id):
+        self.client.table('itinerary_items').delete().eq('id', item_id).execute()
+
+    # --- Actual costs ---
+
+    def create_actual_cost(self, row):
+        data = self.client.table('actual_costs').insert(row).execute()
+        return data.data[0] if data.data else None
+
+    def get_actual_cost(self, cost_id):
+        data = self.client.table('actual_costs').select("*").eq('id', cost_id).execute()
+        return data.data[0] if data.data else None
+
+    def delete_actual_cost(self, cost_id):
+        self.client.table('actual_costs').delete().eq('id', cost_id).execute()
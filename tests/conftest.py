@@ -0,0 +1,7 @@
+import os
+import sys
+
+# The app modules live at the repository root and pick their storage backend at import time
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('STORAGE_BACKEND', 'sqlite')
+os.environ.setdefault('SQLITE_PATH', ':memory:')
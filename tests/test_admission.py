@@ -0,0 +1,123 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('flask')
+
+import admission
+from admission import AdmissionController, AdmissionRejected, MemoryLimiterStore, UpstreamLimit
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(admission, 'time', SimpleNamespace(monotonic=lambda: now[0], time=time.time, sleep=time.sleep))
+    return now
+
+
+def test_bucket_allows_burst_then_refills_at_rate(clock):
+    store = MemoryLimiterStore()
+    assert [store.take_token('u', 0.5, 2)[0] for _ in range(2)] == [True, True]
+    allowed, retry_after = store.take_token('u', 0.5, 2)
+    assert not allowed and retry_after == pytest.approx(2.0)
+    clock[0] += 2
+    assert store.take_token('u', 0.5, 2) == (True, 0.0)
+    assert not store.take_token('u', 0.5, 2)[0]
+    # Buckets are independent
+    assert store.take_token('v', 0.5, 2)[0]
+
+
+def test_refund_token_gives_back_one_token_up_to_burst(clock):
+    store = MemoryLimiterStore()
+    store.take_token('u', 0.001, 2)
+    store.take_token('u', 0.001, 2)
+    store.refund_token('u', 0.001, 2)
+    assert store.take_token('u', 0.001, 2)[0]
+    for _ in range(3):
+        store.refund_token('u', 0.001, 2)
+    assert [store.take_token('u', 0.001, 2)[0] for _ in range(3)] == [True, True, False]
+    # Refunding an unknown bucket doesn't create one
+    store.refund_token('w', 0.001, 2)
+    assert store.bucket_count() == 1
+
+
+def test_buckets_full_for_a_while_are_dropped(clock):
+    store = MemoryLimiterStore(prune_interval=10)
+    store.take_token('idle', 1.0, 5)  # full again after 1 s, droppable after 6 s
+    store.take_token('busy', 0.01, 5)  # full again after 100 s
+    clock[0] += 10
+    store.take_token('busy', 0.01, 5)
+    assert store.bucket_count() == 1
+    # A dropped bucket behaves as a full one
+    assert [store.take_token('idle', 1.0, 5)[0] for _ in range(6)] == [True] * 5 + [False]
+
+
+def test_slots_queue_full_and_timeout():
+    store = MemoryLimiterStore()
+    holders = [store.acquire_slot('llm', 2, 1, 0.2) for _ in range(2)]
+    outcomes = []
+
+    def wait_for_slot():
+        try:
+            store.acquire_slot('llm', 2, 1, 0.2)
+            outcomes.append('admitted')
+        except AdmissionRejected as e:
+            outcomes.append(e.reason)
+
+    waiter = threading.Thread(target=wait_for_slot)
+    waiter.start()
+    time.sleep(0.05)
+    assert store.slot_usage('llm') == (2, 1)
+    with pytest.raises(AdmissionRejected) as rejected:
+        store.acquire_slot('llm', 2, 1, 0.2)
+    assert rejected.value.reason == 'queue_full' and rejected.value.retry_after == 1
+    waiter.join()
+    assert outcomes == ['timeout']
+    assert store.slot_usage('llm') == (2, 0)
+
+    for token in holders:
+        store.release_slot('llm', token)
+    assert store.slot_usage('llm') == (0, 0)
+
+
+def test_waiter_gets_a_released_slot():
+    store = MemoryLimiterStore()
+    token = store.acquire_slot('asr', 1, 1, 1.0)
+    threading.Timer(0.05, store.release_slot, args=('asr', token)).start()
+    store.acquire_slot('asr', 1, 1, 1.0)
+    assert store.slot_usage('asr') == (1, 0)
+
+
+def test_rejected_requests_get_their_token_back():
+    from flask import Flask, jsonify
+
+    app = Flask(__name__)
+    app.secret_key = 'test'
+    controller = AdmissionController(MemoryLimiterStore(), {'llm': UpstreamLimit(0.001, 2, 1, 0, 0.1)})
+    started, finish = threading.Event(), threading.Event()
+
+    @app.errorhandler(AdmissionRejected)
+    def rejected(e):
+        return jsonify({'reason': e.reason}), 429
+
+    @app.route('/generate')
+    @controller.limit('llm')
+    def generate():
+        started.set()
+        finish.wait(1)
+        return 'ok'
+
+    busy = threading.Thread(target=lambda: app.test_client().get('/generate'))
+    busy.start()
+    started.wait(1)
+    client = app.test_client()
+    assert client.get('/generate').json == {'reason': 'queue_full'}
+    finish.set()
+    busy.join()
+    # The queue_full rejection didn't use up the second token of the burst
+    assert client.get('/generate').status_code == 200
+    assert client.get('/generate').json == {'reason': 'rate_limited'}
+    stats = controller.stats()['llm']
+    assert (stats['admitted'], stats['queue_full'], stats['rate_limited']) == (2, 1, 1)
@@ -0,0 +1,166 @@
+import itertools
+import threading
+from datetime import datetime
+
+import pytest
+
+np = pytest.importorskip('numpy')
+pytest.importorskip('dotenv')
+
+import models
+import route_planner
+from route_planner import CoordinateCache, _solve_exact, _solve_heuristic, optimize_day_order, retime
+
+
+def make_items(types):
+    return [models.ItineraryItem(item_type=item_type, description=f'item {index}', order=index)
+            for index, item_type in enumerate(types)]
+
+
+def random_distances(n, seed=0):
+    points = np.random.default_rng(seed).uniform(0, 100, size=(n, 2))
+    return np.sqrt(((points[:, None, :] - points[None, :, :]) ** 2).sum(axis=-1))
+
+
+def path_cost(distances, start_costs, end_costs, order):
+    return (start_costs[order[0]] + end_costs[order[-1]]
+            + sum(distances[a, b] for a, b in zip(order, order[1:])))
+
+
+@pytest.mark.parametrize('seed', range(5))
+def test_solve_exact_matches_brute_force(seed):
+    n = 6
+    rng = np.random.default_rng(seed)
+    distances = random_distances(n, seed)
+    start_costs, end_costs = rng.uniform(0, 100, n), rng.uniform(0, 100, n)
+    best = min(path_cost(distances, start_costs, end_costs, list(order))
+               for order in itertools.permutations(range(n)))
+    order = _solve_exact(distances, start_costs, end_costs)
+    assert sorted(order) == list(range(n))
+    assert path_cost(distances, start_costs, end_costs, order) == pytest.approx(best)
+
+
+@pytest.mark.parametrize('n', [2, 9, 30])
+def test_solve_heuristic_returns_a_permutation(n):
+    rng = np.random.default_rng(n)
+    distances = random_distances(n, n)
+    start_costs, end_costs = rng.uniform(0, 100, n), rng.uniform(0, 100, n)
+    order = _solve_heuristic(distances, start_costs, end_costs)
+    assert sorted(order) == list(range(n))
+
+
+def test_solve_heuristic_never_worse_than_nearest_neighbour_start():
+    n = 20
+    distances = random_distances(n, 7)
+    zeros = np.zeros(n)
+    improved = _solve_heuristic(distances, zeros, zeros)
+    unimproved = _solve_heuristic(distances, zeros, zeros, max_rounds=0)
+    assert path_cost(distances, zeros, zeros, improved) <= path_cost(distances, zeros, zeros, unimproved) + 1e-9
+
+
+def test_optimize_day_order_keeps_anchors_in_place():
+    types = ['Hotel', 'Sightseeing', 'Sightseeing', 'Meal', 'Sightseeing', 'Sightseeing', 'Transportation', 'Hotel']
+    items = make_items(types)
+    order = optimize_day_order(items, random_distances(len(items), 3))
+    assert sorted(order) == list(range(len(items)))
+    for position, item_type in enumerate(types):
+        if item_type in route_planner.FIXED_ITEM_TYPES:
+            assert order[position] == position
+    # Movable items only trade places within their own segment
+    assert set(order[1:3]) == {1, 2}
+    assert set(order[4:6]) == {4, 5}
+
+
+def test_optimize_day_order_keeps_fixed_item_ids_and_unlocated_items_in_place():
+    items = make_items(['Sightseeing'] * 7)
+    distances = random_distances(len(items), 11)
+    distances[4, :] = distances[:, 4] = np.nan
+    order = optimize_day_order(items, distances, fixed_item_ids={items[2].id})
+    assert sorted(order) == list(range(len(items)))
+    assert order[2] == 2
+    assert order[4] == 4
+    assert set(order[:2]) == {0, 1}
+    assert set(order[5:]) == {5, 6}
+
+
+def test_optimize_day_order_shortens_a_zigzag():
+    # Points on a line visited out of order between two hotels at the ends
+    positions = [0, 3, 1, 4, 2, 5]
+    items = make_items(['Hotel', 'Sightseeing', 'Sightseeing', 'Sightseeing', 'Sightseeing', 'Hotel'])
+    distances = np.abs(np.subtract.outer(positions, positions)).astype(float)
+    order = optimize_day_order(items, distances)
+    assert [positions[index] for index in order] == [0, 1, 2, 3, 4, 5]
+
+
+def test_retime_keeps_each_block_window_and_item_durations():
+    day = datetime(2024, 5, 1)
+    slots = [(9, 0, 10, 0), (10, 30, 12, 0), (13, 0, 13, 30), (14, 0, 16, 0), (16, 0, 17, 0)]
+    items = make_items(['Sightseeing'] * len(slots))
+    for item, (h1, m1, h2, m2) in zip(items, slots):
+        item.start_time = day.replace(hour=h1, minute=m1)
+        item.end_time = day.replace(hour=h2, minute=m2)
+    # Two blocks: positions 0-2 are rotated, 3-4 are swapped
+    order = [2, 0, 1, 4, 3]
+    changed = retime(items, order)
+    times = {item.id: changed.get(item.id, (item.start_time, item.end_time)) for item in items}
+
+    for block in ([0, 1, 2], [3, 4]):
+        reordered = [items[order[position]] for position in block]
+        assert times[reordered[0].id][0] == items[block[0]].start_time
+        assert times[reordered[-1].id][1] <= items[block[-1]].end_time
+        for previous, item in zip(reordered, reordered[1:]):
+            assert times[item.id][0] >= times[previous.id][1]
+    for item in items:
+        start, end = times[item.id]
+        assert end - start == item.end_time - item.start_time
+
+
+def test_retime_skips_blocks_with_untimed_items():
+    items = make_items(['Sightseeing'] * 3)
+    items[0].start_time, items[0].end_time = datetime(2024, 5, 1, 9), datetime(2024, 5, 1, 10)
+    items[2].start_time, items[2].end_time = datetime(2024, 5, 1, 11), datetime(2024, 5, 1, 12)
+    assert retime(items, [1, 0, 2]) == {}
+    assert retime(items, [0, 1, 2]) == {}
+
+
+class CountingGeocoder:
+    def __init__(self):
+        self.calls = []
+
+    def geocode(self, pairs):
+        self.calls.append(list(pairs))
+        return {pair: (30.0, 120.0) for pair in pairs}
+
+
+def test_coordinate_cache_caps_geocoding_per_lookup():
+    geocoder = CountingGeocoder()
+    cache = CoordinateCache(geocoder, max_geocode_per_lookup=3)
+    pairs = [(f'place {index}', 'Hangzhou') for index in range(5)]
+    found, failed = cache.lookup(pairs)
+    assert len(geocoder.calls[0]) == 3
+    assert sum(coordinates is not None for coordinates in found.values()) == 3
+    assert not failed
+    # The deferred pairs aren't cached as misses, so the next lookup geocodes them
+    found, _ = cache.lookup(pairs)
+    assert len(geocoder.calls[1]) == 2
+    assert all(coordinates is not None for coordinates in found.values())
+
+
+def test_amap_geocoder_requires_a_key():
+    with pytest.raises(ValueError):
+        route_planner.create_geocoder('amap', amap_key=None)
+
+
+def test_amap_geocoder_runs_batches_concurrently(monkeypatch):
+    geocoder = route_planner.AMapGeocoder('key', max_concurrency=3)
+    barrier = threading.Barrier(3, timeout=5)
+
+    def geocode_batch(city, names):
+        barrier.wait()  # Only passes once all three batches are in flight
+        return {(name, city): (1.0, 2.0) for name in names}
+
+    monkeypatch.setattr(geocoder, '_geocode_batch', geocode_batch)
+    # Two batches for A, one for B
+    pairs = [(f'place {index}', 'A') for index in range(15)] + [(f'place {index}', 'B') for index in range(5)]
+    coordinates = geocoder.geocode(pairs)
+    assert set(coordinates) == set(pairs)
@@ -0,0 +1,116 @@
+import time
+from datetime import date
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+import models
+from search_index import SearchIndex, _UserIndex, tokenize
+
+
+def make_plan(user_id, title, items, description=''):
+    day = models.Day(date=date(2024, 5, 1))
+    for order, (text, place, city) in enumerate(items):
+        location = models.Location(name=place, city=city) if place else None
+        day.items.append(models.ItineraryItem(item_type='Sightseeing', description=text, location=location, order=order))
+    return models.TravelPlan(user_id=user_id, title=title, description=description, days=[day])
+
+
+def test_tokenize_lowercases_words():
+    assert tokenize('Visit the LOUVRE, then café!') == ['visit', 'the', 'louvre', 'then', 'café']
+
+
+def test_tokenize_indexes_cjk_unigrams_and_bigrams():
+    assert tokenize('成都茶馆') == ['成', '都', '茶', '馆', '成都', '都茶', '茶馆']
+
+
+def test_tokenize_queries_cjk_by_bigrams():
+    assert tokenize('茶馆', for_query=True) == ['茶馆']
+    assert tokenize('茶', for_query=True) == ['茶']
+    assert tokenize('Chengdu 茶馆', for_query=True) == ['chengdu', '茶馆']
+
+
+def test_ranking_prefers_query_coverage_then_field_weight():
+    index = _UserIndex()
+    plans = [
+        make_plan('u', '成都美食之旅', [('吃火锅', '蜀九香', '成都')]),
+        make_plan('u', 'Weekend', [('Tea in 成都', None, None)]),
+        make_plan('u', 'Tea trip', [('Morning tea', '鹤鸣茶社', '成都')]),
+    ]
+    for number, plan in enumerate(plans):
+        plan.id = f'p{number}'
+        for item_number, item in enumerate(plan.days[0].items):
+            item.id = f'{plan.id}-i{item_number}'
+        index.add_plan(plan)
+
+    # Only the third plan matches both terms
+    assert [result.plan_id for result in index.search('tea 成都')][0] == 'p2'
+    # A title hit outweighs a free-text hit
+    results = index.search('成都')
+    assert results[0].plan_id == 'p0'
+    assert {result.plan_id for result in results} == {'p0', 'p1', 'p2'}
+    assert results[0].matches == ['吃火锅 (成都 蜀九香)']
+    assert index.search('茶馆') == []
+
+
+def test_remove_plan_drops_postings():
+    index = _UserIndex()
+    plan = make_plan('u', 'Kyoto temples', [('Kinkaku-ji', None, None)])
+    plan.id = 'p'
+    plan.days[0].items[0].id = 'i'
+    index.add_plan(plan)
+    index.remove_plan('p')
+    assert index.search('kyoto') == []
+    assert index.postings == {} and index.docs == {}
+
+
+def test_first_search_indexes_the_user():
+    search_index = SearchIndex()
+    plan = models.create_plan(make_plan('user-a', 'Lisbon', [('Tram 28', 'Alfama', 'Lisbon')]))
+    models.create_plan(make_plan('user-b', 'Lisbon too', []))
+
+    results, total = search_index.search('user-a', 'alfama')
+    assert total == 1 and results[0].plan_id == plan.id
+    assert search_index.search('user-c', 'lisbon') == ([], 0)
+    # Only the users who searched are indexed
+    assert set(search_index._users) == {'user-a', 'user-c'}
+
+
+def test_changes_are_picked_up_without_the_background_thread():
+    search_index = SearchIndex()
+    plan = models.create_plan(make_plan('user-d', 'Porto', [('Port tasting', 'Ribeira', 'Porto')]))
+    assert search_index.search('user-d', 'port')[1] == 1
+
+    models.update_itinerary_item(plan.days[0].items[0].id, {'description': 'Francesinha'})
+    search_index.on_plan_changed(plan.id)
+    assert search_index.search('user-d', 'tasting')[1] == 0
+    assert search_index.search('user-d', 'francesinha')[1] == 1
+
+    models.delete_plan(plan.id)
+    search_index.on_plan_changed(plan.id)
+    assert search_index.search('user-d', 'porto') == ([], 0)
+
+
+def test_stale_users_are_compared_with_their_plan_rows():
+    search_index = SearchIndex(refresh_interval=0)
+    plan = models.create_plan(make_plan('user-e', 'Seville', []))
+    assert search_index.search('user-e', 'seville')[1] == 1
+    # A change made elsewhere, without a notification
+    models.delete_plan(plan.id)
+    assert search_index.search('user-e', 'seville') == ([], 0)
+
+
+def test_background_thread_reindexes_changed_plans():
+    search_index = SearchIndex()
+    search_index.start()
+    plan = models.create_plan(make_plan('user-f', 'Granada', [('Alhambra', None, None)]))
+    assert search_index.search('user-f', 'alhambra')[1] == 1
+
+    models.update_itinerary_item(plan.days[0].items[0].id, {'description': 'Albaicín'})
+    search_index.on_plan_changed(plan.id)
+    deadline = time.monotonic() + 5
+    while search_index.search('user-f', 'albaicín')[1] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    assert search_index.search('user-f', 'albaicín')[1] == 1
+    assert search_index.search('user-f', 'alhambra')[1] == 0
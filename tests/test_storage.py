@@ -0,0 +1,34 @@
+from datetime import date
+
+import pytest
+
+from storage.base import PlanRepository
+
+pytest.importorskip('werkzeug')
+
+from storage.sqlite_backend import SQLiteRepository
+
+
+def test_backend_missing_a_method_fails_on_creation():
+    class Incomplete(PlanRepository):
+        def sign_in(self, email, password):
+            return None
+
+    with pytest.raises(TypeError):
+        Incomplete()
+
+
+def test_get_days_honors_offset_with_and_without_limit():
+    repository = SQLiteRepository(':memory:')
+    repository.insert_plan_trees(
+        [{'id': 'p', 'user_id': 'u', 'title': 'Trip', 'description': '',
+          'created_at': '2024-05-01T00:00:00', 'updated_at': '2024-05-01T00:00:00'}],
+        [{'id': f'd{n}', 'plan_id': 'p', 'date': date(2024, 5, n).isoformat()} for n in (3, 1, 2, 4)],
+        [], [], chunk_size=500)
+
+    days, total = repository.get_days('p', 1, None)
+    assert total == 4 and [day['id'] for day in days] == ['d2', 'd3', 'd4']
+    days, _ = repository.get_days('p', 1, 2)
+    assert [day['id'] for day in days] == ['d2', 'd3']
+    days, _ = repository.get_days('p', 0, None)
+    assert len(days) == 4
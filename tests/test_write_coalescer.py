@@ -0,0 +1,102 @@
+import threading
+from datetime import date
+
+import pytest
+
+pytest.importorskip('dotenv')
+
+import models
+from write_coalescer import CoalescedWriteError, WriteCoalescer
+
+
+class RecordingFlush:
+    def __init__(self, fail=False):
+        self.calls = []
+        self.fail = fail
+
+    def __call__(self, updates):
+        self.calls.append(updates)
+        if self.fail:
+            raise RuntimeError("database unavailable")
+        return {item_id: dict(fields, id=item_id) for item_id, fields in updates.items()}
+
+
+def test_updates_in_one_window_are_merged_into_one_flush():
+    flush = RecordingFlush()
+    coalescer = WriteCoalescer(flush, window=0.05)
+    first = coalescer.submit([('a', {'description': 'old', 'order': 1})])
+    second = coalescer.submit([('a', {'description': 'new'}), ('b', {'order': 0})])
+
+    rows, superseded = coalescer.wait(first)
+    assert flush.calls == [{'a': {'description': 'new', 'order': 1}, 'b': {'order': 0}}]
+    assert rows == {'a': {'id': 'a', 'description': 'new', 'order': 1}}
+    assert superseded == {'a': ['description']}
+    assert coalescer.wait(second) == ({'a': flush.calls[0]['a'] | {'id': 'a'}, 'b': {'id': 'b', 'order': 0}}, {})
+    assert coalescer.stats() == {'submitted': 3, 'flushes': 1, 'superseded_fields': 1}
+
+
+def test_later_arrival_wins_across_threads():
+    flush = RecordingFlush()
+    coalescer = WriteCoalescer(flush, window=0.1)
+    tickets = []
+
+    def edit(value):
+        tickets.append((value, coalescer.submit([('a', {'description': value})])))
+
+    threads = [threading.Thread(target=edit, args=(str(n),)) for n in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    results = {value: coalescer.wait(ticket)[1] for value, ticket in tickets}
+    # Exactly one edit is written; every other one is reported as superseded
+    assert len(flush.calls) == 1
+    assert results.pop(flush.calls[0]['a']['description']) == {}
+    assert all(superseded == {'a': ['description']} for superseded in results.values())
+
+
+def test_batches_are_flushed_in_order():
+    flush = RecordingFlush()
+    coalescer = WriteCoalescer(flush, window=0.01)
+    coalescer.update([('a', {'description': 'first'})])
+    rows, superseded = coalescer.update([('a', {'description': 'second'})])
+    assert [call['a']['description'] for call in flush.calls] == ['first', 'second']
+    assert rows['a']['description'] == 'second' and superseded == {}
+
+
+def test_flush_error_fails_only_its_batch():
+    flush = RecordingFlush(fail=True)
+    coalescer = WriteCoalescer(flush, window=0.01)
+    with pytest.raises(CoalescedWriteError, match='database unavailable'):
+        coalescer.update([('a', {'order': 1})])
+    flush.fail = False
+    assert coalescer.update([('a', {'order': 2})])[0] == {'a': {'id': 'a', 'order': 2}}
+
+
+def test_clean_item_update_rejects_bad_values_before_they_are_batched():
+    assert models.clean_item_update({'id': 'x', 'start_time': '2024-05-01T08:00', 'end_time': '',
+                                     'estimated_cost': '12.5', 'order': '3', 'description': 'Tea'}) == {
+        'start_time': '2024-05-01T08:00:00', 'end_time': None, 'estimated_cost': 12.5, 'order': 3, 'description': 'Tea'}
+    for bad in ({'start_time': 'tomorrow'}, {'estimated_cost': 'free'}, {'estimated_cost': -1}, {'order': 'first'},
+                {'order': 1.5}, {'description': ['x']}):
+        with pytest.raises(ValueError):
+            models.clean_item_update(bad)
+
+
+def test_bulk_update_writes_only_the_given_columns():
+    day = models.Day(date=date(2024, 5, 1), items=[
+        models.ItineraryItem(item_type='Sightseeing', description='Temple', order=0, estimated_cost=10.0),
+        models.ItineraryItem(item_type='Meal', description='Noodles', order=1),
+    ])
+    plan = models.create_plan(models.TravelPlan(user_id='owner', title='Kyoto', days=[day]))
+    temple, noodles = plan.days[0].items
+
+    # A concurrent single-item edit lands between a reader's snapshot and the bulk write
+    models.update_itinerary_item(temple.id, {'description': 'Kinkaku-ji'})
+    rows = models.bulk_update_itinerary_items({temple.id: {'order': 1}, noodles.id: {'order': 0}, 'missing': {'order': 2}})
+
+    assert set(rows) == {temple.id, noodles.id}
+    assert rows[temple.id]['description'] == 'Kinkaku-ji' and rows[temple.id]['estimated_cost'] == 10.0
+    assert [item.description for item in models.get_plan(plan.id).days[0].items] == ['Noodles', 'Kinkaku-ji']
+    assert models.user_ids_for_items([temple.id, 'missing']) == {temple.id: 'owner'}
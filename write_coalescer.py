@@ -0,0 +1,113 @@
+import threading
+
+
+class CoalescedWriteError(Exception):
+    pass
+
+
+class _Batch:
+    def __init__(self):
+        self.fields = {}  # item_id -> {field: (seq, value)}
+        self.done = threading.Event()
+        self.results = {}
+        self.error = None
+
+
+class WriteCoalescer:
+    """
+    Merges field updates to the same items that arrive within a short window and
+    writes them with a single bulk call.
+
+    Every update gets a sequence number in the order it reaches the server. For
+    each field the latest update wins (last writer wins); the earlier values are
+    never written and are reported back as superseded. Batches are flushed one at
+    a time, in order, so a later batch always overwrites an earlier one. Ordering
+    is guaranteed within one process only.
+
+    Args:
+        flush: Called with {item_id: fields}; returns {item_id: updated row}.
+        window: Seconds to wait for more updates after the first one of a batch.
+    """
+
+    def __init__(self, flush, window=0.05):
+        self.flush = flush
+        self.window = window
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._batch = None
+        self._seq = 0
+        self.submitted = 0
+        self.flushes = 0
+        self.superseded_fields = 0
+
+    def submit(self, updates):
+        """
+        Queues updates, a list of (item_id, fields), for the next flush.
+        Returns the ticket to pass to wait().
+        """
+        with self._lock:
+            batch = self._batch
+            if batch is None:
+                batch = self._batch = _Batch()
+                timer = threading.Timer(self.window, self._flush, args=(batch,))
+                timer.daemon = True
+                timer.start()
+            entries = []
+            for item_id, fields in updates:
+                self._seq += 1
+                pending = batch.fields.setdefault(item_id, {})
+                for field, value in fields.items():
+                    if field in pending:
+                        self.superseded_fields += 1
+                    pending[field] = (self._seq, value)
+                entries.append((item_id, self._seq, list(fields)))
+                self.submitted += 1
+            return batch, entries
+
+    def wait(self, ticket, timeout=10):
+        """
+        Waits for the ticket's batch to be written. Returns ({item_id: updated row},
+        {item_id: [fields overwritten by later updates in the same batch]}).
+        """
+        batch, entries = ticket
+        if not batch.done.wait(timeout):
+            raise CoalescedWriteError("Timed out waiting for the batched write")
+        if batch.error is not None:
+            raise CoalescedWriteError(str(batch.error))
+        rows = {}
+        superseded = {}
+        for item_id, seq, fields in entries:
+            if item_id in batch.results:
+                rows[item_id] = batch.results[item_id]
+            lost = [field for field in fields if batch.fields[item_id][field][0] != seq]
+            if lost:
+                superseded.setdefault(item_id, []).extend(lost)
+        return rows, superseded
+
+    def update(self, updates, timeout=10):
+        """Submits updates and waits for their flush."""
+        return self.wait(self.submit(updates), timeout)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'flushes': self.flushes,
+                'superseded_fields': self.superseded_fields,
+            }
+
+    def _flush(self, batch):
+        with self._flush_lock:
+            with self._lock:
+                if self._batch is batch:
+                    self._batch = None
+            updates = {item_id: {field: value for field, (_, value) in fields.items()}
+                       for item_id, fields in batch.fields.items()}
+            try:
+                batch.results = self.flush(updates)
+            except Exception as e:
+                batch.error = e
+            finally:
+                with self._lock:
+                    self.flushes += 1
+                batch.done.set()